@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+#
+#
+"""
+obspy anss module
+
+Names are imported from their submodules on first use, so importing this
+package doesn't load ObsPy until needed.
+"""
+from obspy_ext.lazy import lazy_package
+
+lazy_package(__name__, {
+    'NamespacePickler'      : 'quakeml',
+    'writeNamespaceQuakeML' : 'quakeml',
+    'streamNamespaceQuakeML': 'quakeml',
+    'writeChangedQuakeML'   : 'quakeml',
+    'writeNamespaceQuakeMLFiles' : 'quakeml',
+    'FragmentCache'         : 'quakeml',
+    'iterNamespaceQuakeML'  : 'quakeml',
+    })
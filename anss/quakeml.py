@@ -16,10 +16,20 @@
 # ...                }
 # ...    )
 #
+import hashlib
+import os
+import pickle
+import re
+import tempfile
+from collections import Counter, OrderedDict
+from copy import deepcopy
+from itertools import islice
+from multiprocessing import Pool
+from lxml import etree
 from obspy.core import UTCDateTime
 # get rid of star import
 from obspy.core.event import *
-from obspy.core.quakeml import Pickler
+from obspy.core.quakeml import Pickler, Unpickler
 from obspy.core.util import tostring
    
 ##############################################################################
@@ -84,89 +94,400 @@ class NamespacePickler(Pickler):
         """
         return self._serialize(catalog, **kwargs)
 
-    def _serialize(self, catalog, pretty_print=True, **kwargs):
+    def _setup(self, kwargs):
         """
-        Converts a Catalog object into XML string.
+        Namespace map and namespaced attributes from _serialize kwargs.
 
-        Modified by Mark - Check for namespaces and attributes for ANSS/USGS
-        ----------------
-        Can pass a namespace map 'nsmap' and 'attributes' dict keyed by map
-        prefix in as kwargs.
-
-        Hard coded to put these attributes into specific esoteric elements
-        (event and focalMechanism, for now) for ANSS reporting to USGS.
-        
+        The map is copied to the instance before it is updated, so one call
+        passing an 'nsmap' doesn't change the class default for the next.
         """
         # -MCW added if-else to specify ns0 namespace if desired
-        root_prefix = 'q'
         ns_attr = {}
         # allow for namespace map specification (optional)
         if 'nsmap' in kwargs:
+            self.nsmap = dict(self.nsmap)
             self.nsmap.update(kwargs['nsmap'])
         # map attributes to proper namespacei using self.nsmap
         if 'attributes' in kwargs:
             ns_attr = self._namespaced_attributes(kwargs['attributes'])
         # -MCW end
-        root_el = etree.Element(
-            self._prefix('quakeml', root_prefix),
+        return ns_attr
+
+    def _root(self):
+        """Root element, with the namespace map"""
+        root_prefix = 'q'
+        return etree.Element(self._prefix('quakeml', root_prefix),
             nsmap=self.nsmap) # -MCW
+
+    def _catalog(self, catalog):
+        """eventParameters element of a catalog, without its events"""
         catalog_el = etree.Element('eventParameters',
             attrib={'publicID': self._id(catalog.resource_id)})
         if catalog.description:
             self._str(catalog.description, catalog_el, 'description')
         self._comments(catalog.comments, catalog_el)
         self._creation_info(catalog.creation_info, catalog_el)
+        return catalog_el
+
+    def _event(self, event, ns_attr):
+        """event element, with namespaced attributes in it (and in its
+        focalMechanisms)"""
+        # create event node
+        event_el = etree.Element('event',
+            attrib={'publicID': self._id(event.resource_id)})
+        event_el.attrib.update(ns_attr) # -MCW
+        # optional event attributes
+        if hasattr(event, "preferred_origin_id"):
+            self._str(event.preferred_origin_id, event_el,
+                    'preferredOriginID')
+        if hasattr(event, "preferred_magnitude_id"):
+            self._str(event.preferred_magnitude_id, event_el,
+                     'preferredMagnitudeID')
+        if hasattr(event, "preferred_focal_mechanism_id"):
+            self._str(event.preferred_focal_mechanism_id, event_el,
+                     'preferredFocalMechanismID')
+        # event type and event type certainty also are optional attributes.
+        if hasattr(event, "event_type"):
+            self._str(event.event_type, event_el, 'type')
+        if hasattr(event, "event_type_certainty"):
+            self._str(event.event_type_certainty, event_el,
+                'typeCertainty')
+        # event descriptions
+        for description in event.event_descriptions:
+            el = etree.Element('description')
+            self._str(description.text, el, 'text', True)
+            self._str(description.type, el, 'type')
+            event_el.append(el)
+        self._comments(event.comments, event_el)
+        self._creation_info(event.creation_info, event_el)
+        # origins
+        for origin in event.origins:
+            event_el.append(self._origin(origin))
+        # magnitudes
+        for magnitude in event.magnitudes:
+            event_el.append(self._magnitude(magnitude))
+        # station magnitudes
+        for magnitude in event.station_magnitudes:
+            event_el.append(self._station_magnitude(magnitude))
+        # picks
+        for pick in event.picks:
+            event_el.append(self._pick(pick))
+        # focal mechanisms -MCW add ns attribs
+        for focal_mechanism in event.focal_mechanisms:
+            focal_mech_el = self._focal_mechanism(focal_mechanism)
+            focal_mech_el.attrib.update(ns_attr)
+            event_el.append(focal_mech_el)
+        return event_el
+
+    def _serialize(self, catalog, pretty_print=True, **kwargs):
+        """
+        Converts a Catalog object into XML string.
+
+        Modified by Mark - Check for namespaces and attributes for ANSS/USGS
+        ----------------
+        Can pass a namespace map 'nsmap' and 'attributes' dict keyed by map
+        prefix in as kwargs.
+
+        With 'workers' > 1, events are serialized in a pool of that many
+        processes and joined in order (same bytes as the serial path).
+        With a FragmentCache as 'cache', only events not in it are
+        serialized.
+
+        Hard coded to put these attributes into specific esoteric elements
+        (event and focalMechanism, for now) for ANSS reporting to USGS.
+        
+        """
+        workers = kwargs.pop('workers', None)
+        cache = kwargs.pop('cache', None)
+        if (cache is not None or workers and workers > 1) and len(catalog):
+            head, foot = self.head_foot(catalog, pretty_print, **kwargs)
+            if cache is not None:
+                fragments = cache.serialize(catalog, pretty_print, workers,
+                                            **kwargs)
+            else:
+                fragments = self._fragments(catalog, pretty_print, workers,
+                                            **kwargs)
+            return head + b''.join(fragments) + foot
+        ns_attr = self._setup(kwargs)
+        root_el = self._root()
+        catalog_el = self._catalog(catalog)
         root_el.append(catalog_el)
         for event in catalog:
-            # create event node
-            event_el = etree.Element('event',
-                attrib={'publicID': self._id(event.resource_id)})
-            event_el.attrib.update(ns_attr) # -MCW
-            # optional event attributes
-            if hasattr(event, "preferred_origin_id"):
-                self._str(event.preferred_origin_id, event_el,
-                        'preferredOriginID')
-            if hasattr(event, "preferred_magnitude_id"):
-                self._str(event.preferred_magnitude_id, event_el,
-                         'preferredMagnitudeID')
-            if hasattr(event, "preferred_focal_mechanism_id"):
-                self._str(event.preferred_focal_mechanism_id, event_el,
-                         'preferredFocalMechanismID')
-            # event type and event type certainty also are optional attributes.
-            if hasattr(event, "event_type"):
-                self._str(event.event_type, event_el, 'type')
-            if hasattr(event, "event_type_certainty"):
-                self._str(event.event_type_certainty, event_el,
-                    'typeCertainty')
-            # event descriptions
-            for description in event.event_descriptions:
-                el = etree.Element('description')
-                self._str(description.text, el, 'text', True)
-                self._str(description.type, el, 'type')
-                event_el.append(el)
-            self._comments(event.comments, event_el)
-            self._creation_info(event.creation_info, event_el)
-            # origins
-            for origin in event.origins:
-                event_el.append(self._origin(origin))
-            # magnitudes
-            for magnitude in event.magnitudes:
-                event_el.append(self._magnitude(magnitude))
-            # station magnitudes
-            for magnitude in event.station_magnitudes:
-                event_el.append(self._station_magnitude(magnitude))
-            # picks
-            for pick in event.picks:
-                event_el.append(self._pick(pick))
-            # focal mechanisms -MCW add ns attribs
-            for focal_mechanism in event.focal_mechanisms:
-                focal_mech_el = self._focal_mechanism(focal_mechanism)
-                focal_mech_el.attrib.update(ns_attr)
-                event_el.append(focal_mech_el)
             # add event node to catalog
-            catalog_el.append(event_el)
+            catalog_el.append(self._event(event, ns_attr))
         return tostring(root_el, pretty_print=pretty_print)
 
+    # Serializing a piece at a time
+    #
+    # A document is the head (declaration, root and eventParameters header),
+    # the events, and the foot (closing tags). Each event serializes to the
+    # same bytes on its own as in the whole tree, as namespaces are only
+    # declared on the root and pretty printing only depends on depth, so
+    # the pieces can be made separately and joined.
+    #
+    def head_foot(self, catalog, pretty_print=True, **kwargs):
+        """
+        Bytes before the first event and after the last one in a document
+        of the catalog, see _serialize for the kwargs.
+        """
+        self._setup(kwargs)
+        root_el = self._root()
+        catalog_el = self._catalog(catalog)
+        catalog_el.append(etree.Element('event'))  # placeholder
+        root_el.append(catalog_el)
+        head, body, foot = _split(tostring(root_el, pretty_print=pretty_print),
+                                  pretty_print)
+        return head, foot
+
+    def event_fragment(self, event, pretty_print=True, **kwargs):
+        """
+        Bytes of one event, exactly as it appears in a whole document, see
+        _serialize for the kwargs.
+        """
+        ns_attr = self._setup(kwargs)
+        root_el = self._root()
+        catalog_el = etree.Element('eventParameters')
+        catalog_el.append(self._event(event, ns_attr))
+        root_el.append(catalog_el)
+        head, body, foot = _split(tostring(root_el, pretty_print=pretty_print),
+                                  pretty_print)
+        return body
+
+    def _fragments(self, events, pretty_print=True, workers=None, **kwargs):
+        """
+        Generate event_fragment bytes of events, in order, serialized in a
+        pool of 'workers' processes if more than one.
+
+        The pool is fed FRAGMENT_BATCH events per worker at a time, with at
+        most two batches (one being written, one being serialized) pulled
+        from 'events', so a generator is never read far ahead (Pool.imap
+        would read all of it up front).
+        """
+        if not workers or workers < 2:
+            for event in events:
+                yield self.event_fragment(event, pretty_print, **kwargs)
+            return
+        events = iter(events)
+        size = workers * FRAGMENT_BATCH
+        pool = Pool(workers)
+        try:
+            pending = None
+            while True:
+                tasks = [(event, pretty_print, kwargs)
+                         for event in islice(events, size)]
+                result = None
+                if tasks:
+                    result = pool.map_async(_event_fragment, tasks, chunksize=16)
+                if pending is not None:
+                    for fragment in pending.get():
+                        yield fragment
+                if result is None:
+                    break
+                pending = result
+        except:
+            pool.terminate()
+            raise
+        pool.close()
+        pool.join()
+
+    def dump(self, events, fh, catalog=None, pretty_print=True, **kwargs):
+        """
+        Write QuakeML to a file, serializing one event at a time.
+
+        Only one event's tree is held in memory at a time, and the output
+        is the same as writing a Catalog of the events with dumps.
+
+        :type events: iterable
+        :param events: Events (or a Catalog) to write, e.g. a generator
+        :type fh: file
+        :param fh: File (opened for binary writing) to write to
+        :type catalog: :class:`~obspy.core.event.Catalog`
+        :param catalog: Catalog for the eventParameters header (default:
+            'events' if it is a Catalog, else a new empty one)
+        :type workers: int
+        :param workers: keyword only, serialize events in a pool of this
+            many processes (written in order, as they are done)
+        :type cache: FragmentCache
+        :param cache: keyword only, reuse fragments of unchanged events
+            (the events are then all gathered up front)
+        :rtype: int
+        :return: Number of events written
+        """
+        workers = kwargs.pop('workers', None)
+        cache = kwargs.pop('cache', None)
+        if catalog is None:
+            catalog = events if isinstance(events, Catalog) else Catalog()
+        head, foot = self.head_foot(catalog, pretty_print, **kwargs)
+        if cache is not None:
+            fragments = cache.serialize(events, pretty_print, workers, **kwargs)
+        else:
+            fragments = self._fragments(events, pretty_print, workers, **kwargs)
+        count = 0
+        for fragment in fragments:
+            if not count:
+                fh.write(head)
+            fh.write(fragment)
+            count += 1
+        if count:
+            fh.write(foot)
+        else:
+            # No events: an empty eventParameters, as dumps would write
+            fh.write(self.dumps(Catalog(resource_id=catalog.resource_id,
+                                        description=catalog.description,
+                                        comments=catalog.comments,
+                                        creation_info=catalog.creation_info),
+                                pretty_print=pretty_print, **kwargs))
+        return count
+
+
+def _canonical(obj):
+    """
+    Stable text of an event (or any part of one), for content hashes.
+
+    Dict-like ObsPy objects are written as their sorted items, resource
+    ids as their id, and plain values by repr.
+    """
+    if isinstance(obj, ResourceIdentifier):
+        return 'ResourceIdentifier({0!r})'.format(str(obj))
+    if isinstance(obj, (list, tuple)):
+        return '[{0}]'.format(', '.join([_canonical(o) for o in obj]))
+    if hasattr(obj, 'items'):
+        items = obj.items()
+    elif hasattr(obj, '__dict__') and not isinstance(obj, UTCDateTime):
+        items = vars(obj).items()
+    else:
+        return repr(obj)
+    items = sorted(items, key=lambda kv: repr(kv[0]))
+    return '{0}{{{1}}}'.format(type(obj).__name__,
+        ', '.join(['{0!r}: {1}'.format(k, _canonical(v)) for k, v in items]))
+
+
+class FragmentCache(object):
+    """
+    Serialized event fragments, reused as long as the event is unchanged.
+
+    Fragments are keyed by a content hash of the event and the options it
+    was serialized with (pretty_print, nsmap and attributes), so changing
+    any of them means a new fragment. serialize() only serializes events
+    it hasn't seen, and keeps track of which events (by publicID) changed
+    since the previous call, to send just those as new submissions.
+
+    .. rubric:: Example
+    >>> cache = FragmentCache.load('anss.cache')
+    >>> writeNamespaceQuakeML(catalog, 'catalog.xml', cache=cache, attributes=atts)
+    >>> writeChangedQuakeML(cache, 'outgoing/{name}.xml', catalog=catalog, attributes=atts)
+    >>> cache.save('anss.cache')
+    """
+    def __init__(self):
+        self._fragments = {}   # content key -> bytes
+        self._keys = {}        # event publicID -> content key
+        self.changed = []
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._fragments)
+
+    def __repr__(self):
+        return "{0}({1} fragments, {2} hits, {3} misses)".format(
+            self.__class__.__name__, len(self), self.hits, self.misses)
+
+    @staticmethod
+    def key(event, pretty_print=True, **kwargs):
+        """Content hash of an event and its serialization options"""
+        options = (bool(pretty_print), kwargs.get('nsmap'),
+                   kwargs.get('attributes'))
+        text = _canonical(event) + _canonical(options)
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def serialize(self, events, pretty_print=True, workers=None, **kwargs):
+        """
+        Fragments of events, in order, serializing only the ones not in the
+        cache (in a pool of processes if workers > 1).
+
+        Sets 'changed' to the events which are new or changed since the
+        last call, and forgets the events (and fragments) which are not in
+        this call's events anymore.
+
+        :rtype: list
+        :return: event_fragment bytes of each event
+        :raises ValueError: if two events have the same publicID, as they
+            can't be told apart in the cache or in a submission
+        """
+        events = list(events)
+        public_ids = [str(event.resource_id) for event in events]
+        if len(set(public_ids)) != len(public_ids):
+            counts = Counter(public_ids)
+            raise ValueError("Events with the same publicID: {0}".format(
+                ', '.join(sorted([i for i in counts if counts[i] > 1]))))
+        keys = [self.key(event, pretty_print, **kwargs) for event in events]
+        missing = OrderedDict()
+        for event, key in zip(events, keys):
+            if key not in self._fragments and key not in missing:
+                missing[key] = event
+        self.misses += len(missing)
+        self.hits += len(events) - len(missing)
+        fragments = NamespacePickler()._fragments(missing.values(),
+            pretty_print, workers, **kwargs)
+        for key, fragment in zip(missing, fragments):
+            self._fragments[key] = fragment
+        self.changed = [event for event, public_id, key
+                        in zip(events, public_ids, keys)
+                        if self._keys.get(public_id) != key]
+        self._keys = dict(zip(public_ids, keys))
+        used = set(keys)
+        for key in list(self._fragments):
+            if key not in used:
+                del self._fragments[key]
+        return [self._fragments[key] for key in keys]
+
+    def fragment(self, event, pretty_print=True, **kwargs):
+        """Cached fragment of an event (KeyError if it isn't cached)"""
+        return self._fragments[self.key(event, pretty_print, **kwargs)]
+
+    def save(self, filename):
+        """Pickle the cache to a file"""
+        with open(filename, 'wb') as fh:
+            pickle.dump((self._fragments, self._keys), fh,
+                        pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, filename):
+        """A cache pickled by save, or an empty one if there's no file"""
+        cache = cls()
+        try:
+            with open(filename, 'rb') as fh:
+                cache._fragments, cache._keys = pickle.load(fh)
+        except (IOError, OSError):
+            pass
+        return cache
+
+
+def _event_fragment(task):
+    """Pool worker: event_fragment of an (event, pretty_print, kwargs) task"""
+    event, pretty_print, kwargs = task
+    return NamespacePickler().event_fragment(event, pretty_print, **kwargs)
+
+
+_EVENT_TAG = re.compile(br'<event[\s/>]')
+
+# Events per pool worker handed over at a time by NamespacePickler._fragments
+FRAGMENT_BATCH = 64
+
+def _split(doc, pretty_print=True):
+    """
+    Split a serialized document into (head, events, foot) bytes.
+
+    With pretty printing, the events start and end on line boundaries,
+    so each event carries its own indent and newline.
+    """
+    start = _EVENT_TAG.search(doc).start()
+    end = doc.rfind(b'</eventParameters>')
+    if pretty_print:
+        start = doc.rfind(b'\n', 0, start) + 1
+        end = doc.rfind(b'\n', 0, end) + 1
+    return doc[:start], doc[start:end], doc[end:]
+
 #
 # Mark's version of the Catalog.write QUAKEML method to pass namespace info
 #
@@ -187,15 +508,257 @@ def writeNamespaceQuakeML(catalog, filename, **kwargs):  # @UnusedVariable
     :type filename: str
     :param filename: Name of file to write.
     """
+    xml_doc = NamespacePickler().dumps(catalog, **kwargs)
     # Open filehandler or use an existing file like object.
     if not hasattr(filename, 'write'):
-        fh = open(filename, 'wt')
+        with open(filename, 'wb') as fh:
+            fh.write(xml_doc)
     else:
-        fh = filename
-    xml_doc = NamespacePickler().dumps(catalog, **kwargs)
-    fh.write(xml_doc)
-    fh.close()
-    # Close if its a file handler.
-    if isinstance(fh, file):
-        fh.close()
+        # Leave a file like object open for the caller
+        filename.write(xml_doc)
+
+def streamNamespaceQuakeML(events, filename, catalog=None, **kwargs):
+    """
+    Writes a QuakeML file one event at a time.
+
+    Same output as writeNamespaceQuakeML, but from any iterable of Events
+    (a generator reading them from a database, say), without building the
+    whole document in memory. See NamespacePickler.dump.
+
+    :type events: iterable
+    :param events: Events (or a Catalog) to write
+    :type filename: str
+    :param filename: Name of file to write, or a file like object
+    :type catalog: :class:`~obspy.core.event.Catalog`
+    :param catalog: Catalog for the eventParameters header
+    :rtype: int
+    :return: Number of events written
+    """
+    if not hasattr(filename, 'write'):
+        with open(filename, 'wb') as fh:
+            return NamespacePickler().dump(events, fh, catalog, **kwargs)
+    return NamespacePickler().dump(events, filename, catalog, **kwargs)
+
+def _umask():
+    """Current umask (read by setting it and putting it back)"""
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+def _atomic_write(fname, chunks):
+    """
+    Write chunks of bytes to a temporary file next to fname, then rename
+    it to fname, so nothing watching the directory sees a partial file.
+    The temporary file is removed if anything fails. The file gets the
+    same mode as one made by open() (0666 less the umask), not the 0600
+    of mkstemp, so e.g. a PDL sender running as another user can read it.
+    """
+    dirname, basename = os.path.split(os.path.abspath(fname))
+    fd, tmp = tempfile.mkstemp(prefix='.' + basename + '.', suffix='.tmp',
+                               dir=dirname)
+    try:
+        with os.fdopen(fd, 'wb') as fh:
+            os.fchmod(fh.fileno(), 0o666 & ~_umask())
+            for chunk in chunks:
+                fh.write(chunk)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.rename(tmp, fname)
+    except:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+
+
+def _write_event_file(task):
+    """
+    Pool worker: write one event's standalone file atomically.
+
+    :type task: tuple
+    :param task: (event, file name, head, fragment or None, foot,
+        pretty_print, kwargs), the fragment is serialized if None
+    :rtype: tuple
+    :return: (publicID, file name, None or the error message)
+    """
+    event, fname, head, fragment, foot, pretty_print, kwargs = task
+    try:
+        if fragment is None:
+            fragment = NamespacePickler().event_fragment(event, pretty_print,
+                                                         **kwargs)
+        _atomic_write(fname, (head, fragment, foot))
+        error = None
+    except Exception as e:
+        error = '{0}: {1}'.format(type(e).__name__, e)
+    return str(event.resource_id), fname, error
+
+
+def _write_event_files(tasks, workers=None):
+    """Run _write_event_file over tasks, in a process pool if workers > 1"""
+    if not workers or workers < 2 or len(tasks) < 2:
+        return [_write_event_file(task) for task in tasks]
+    pool = Pool(min(workers, len(tasks)))
+    try:
+        report = pool.map(_write_event_file, tasks)
+    except:
+        pool.terminate()
+        raise
+    pool.close()
+    pool.join()
+    return report
+
+
+def writeNamespaceQuakeMLFiles(catalog, template, workers=None,
+                               pretty_print=True, **kwargs):
+    """
+    Writes a standalone QuakeML file for each event of a catalog.
+
+    Events are serialized and written in a pool of 'workers' processes.
+    Each file is written to a temporary file in the same directory and
+    renamed into place, so a sender watching the directory (e.g. PDL)
+    never picks up a half-written file, and a failure leaves nothing
+    behind. One event failing doesn't stop the others.
+
+    :type catalog: :class:`~obspy.core.event.Catalog`
+    :param catalog: Events to write, and the eventParameters header
+    :type template: str
+    :param template: File name template, which can use {id} (publicID),
+        {name} (the part of the publicID after the last '/') and {n}
+        (index of the event), e.g. 'outgoing/{name}.xml'
+    :type workers: int
+    :param workers: Number of processes to write with (default: serial)
+    :rtype: list
+    :return: (publicID, file name, error) for each event in order, where
+        error is None if the file was written, or the error message
+
+    .. rubric:: Example
+    >>> report = writeNamespaceQuakeMLFiles(catalog, 'outgoing/{name}.xml',
+    ...     workers=4, attributes={'catalog': {'datasource': 'XX'}})
+    >>> failed = [r for r in report if r[2] is not None]
+    """
+    head, foot = NamespacePickler().head_foot(catalog, pretty_print, **kwargs)
+    tasks = [(event, _event_filename(template, event, n), head, None, foot,
+              pretty_print, kwargs) for n, event in enumerate(catalog)]
+    return _write_event_files(tasks, workers)
+
+
+def _event_filename(template, event, n):
+    """
+    File name of an event from a template, which can use {id} (publicID),
+    {name} (the part of the publicID after the last '/') and {n} (index)
+    """
+    public_id = str(event.resource_id)
+    return template.format(id=public_id, name=public_id.rsplit('/', 1)[-1],
+                           n=n)
+
+
+def writeChangedQuakeML(cache, template, catalog=None, pretty_print=True,
+                        workers=None, **kwargs):
+    """
+    Writes a standalone QuakeML file for each event which changed in the
+    last cache.serialize (i.e. the last write using the cache).
+
+    The cached fragments are reused, nothing is serialized again. Files
+    are written atomically, as by writeNamespaceQuakeMLFiles.
+
+    :type cache: FragmentCache
+    :param cache: Cache the catalog was last written with
+    :type template: str
+    :param template: File name template, see writeNamespaceQuakeMLFiles
+    :type catalog: :class:`~obspy.core.event.Catalog`
+    :param catalog: Catalog for the eventParameters header
+    :rtype: list
+    :return: (publicID, file name, error) for each changed event, see
+        writeNamespaceQuakeMLFiles
+    """
+    if catalog is None:
+        catalog = Catalog()
+    head, foot = NamespacePickler().head_foot(catalog, pretty_print, **kwargs)
+    tasks = [(event, _event_filename(template, event, n), head,
+              cache.fragment(event, pretty_print, **kwargs), foot,
+              pretty_print, kwargs) for n, event in enumerate(cache.changed)]
+    return _write_event_files(tasks, workers)
+
+##############################################################################
+# reading QuakeML back, with the namespaced attributes
+##############################################################################
+def _localname(el):
+    return etree.QName(el).localname
+
+
+def _namespace_attributes(el):
+    """
+    Namespaced attributes of an element, as a dict of dicts keyed by prefix
+    (the same form as the 'attributes' kwarg of the writers)
+    """
+    prefixes = dict([(uri, prefix) for prefix, uri in el.nsmap.items() if prefix])
+    attributes = {}
+    for name, value in el.attrib.items():
+        qname = etree.QName(name)
+        if qname.namespace is None:
+            continue
+        prefix = prefixes.get(qname.namespace, qname.namespace)
+        attributes.setdefault(prefix, {})[qname.localname] = value
+    return attributes
+
+
+def _load_event(root_el, catalog_el, event_el):
+    """
+    Event from an event element, by handing a one-event document to the
+    ObsPy Unpickler. Namespaced attributes of the event and its focal
+    mechanisms are put in a 'namespace_attributes' attribute of each.
+    """
+    doc = etree.Element(root_el.tag, nsmap=root_el.nsmap)
+    params = etree.SubElement(doc, catalog_el.tag, attrib=dict(catalog_el.attrib))
+    params.append(deepcopy(event_el))
+    event = Unpickler().loads(etree.tostring(doc))[0]
+    attributes = _namespace_attributes(event_el)
+    if attributes:
+        event.namespace_attributes = attributes
+    fm_els = [el for el in event_el if _localname(el) == 'focalMechanism']
+    for focal_mechanism, fm_el in zip(event.focal_mechanisms, fm_els):
+        attributes = _namespace_attributes(fm_el)
+        if attributes:
+            focal_mechanism.namespace_attributes = attributes
+    return event
+
+
+def iterNamespaceQuakeML(filename):
+    """
+    Reads a QuakeML file one Event at a time.
+
+    The file is parsed incrementally, and each event element is cleared
+    (and dropped from the tree) once its Event is made, so memory stays
+    bounded by the size of one event, however big the catalog.
+
+    Unlike obspy.core.event.readEvents, the namespaced attributes of event
+    and focalMechanism elements (e.g. catalog:datasource, catalog:dataid,
+    catalog:eventsource) are kept, as 'namespace_attributes' of the Event
+    or FocalMechanism, in the same dict of dicts form as the 'attributes'
+    kwarg of the writers:
+
+    >>> for event in iterNamespaceQuakeML('quakeml.xml'):
+    ...     print event.namespace_attributes
+    {'catalog': {'datasource': 'ZZ', 'dataid': '999999'}}
+
+    :type filename: str
+    :param filename: Name of file to read, or a file like object
+    :rtype: generator
+    """
+    root_el = None
+    catalog_el = None
+    for action, el in etree.iterparse(filename, events=('start', 'end')):
+        if action == 'start':
+            if root_el is None:
+                root_el = el
+            elif catalog_el is None and _localname(el) == 'eventParameters':
+                catalog_el = el
+            continue
+        if _localname(el) != 'event' or el.getparent() is not catalog_el:
+            continue
+        event = _load_event(root_el, catalog_el, el)
+        el.clear()
+        while el.getprevious() is not None:
+            del catalog_el[0]
+        yield event
 #-----------------------------------------------------------------------------
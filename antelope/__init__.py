@@ -3,8 +3,49 @@
 #
 """
 obspy antelope module
+
+Names are imported from their submodules on first use, so importing this
+package doesn't load the Antelope libraries or ObsPy until needed.
 """
-from obspy_ext.antelope.core import (db2object, readANTELOPE)
-from obspy_ext.antelope.dbobjects import (Dbrecord, DbrecordList)
-from obspy_ext.antelope.dbpointers import (DbrecordPtr, DbrecordPtrList, AttribDbptr)
-from obspy_ext.antelope.utils import (add_antelope_path, open_db_or_string)
+from obspy_ext.lazy import lazy_package
+
+lazy_package(__name__, {
+    # core
+    'db2object'         : 'core',
+    'to_structured'     : 'core',
+    'readANTELOPE'      : 'core',
+    'iter_antelope'     : 'core',
+    'cut_antelope'      : 'core',
+    'wfdisc_index'      : 'core',
+    # catalog
+    'db2catalog'        : 'catalog',
+    # wfdisc
+    'WfdiscIndex'       : 'wfdisc',
+    'WaveformCache'     : 'wfdisc',
+    # snapshot
+    'Snapshot'          : 'snapshot',
+    'take_snapshot'     : 'snapshot',
+    # flatfile
+    'FlatSchema'        : 'flatfile',
+    'FlatTable'         : 'flatfile',
+    # query
+    'DbQuery'           : 'query',
+    # dbobjects
+    'Dbrecord'          : 'dbobjects',
+    'DbrecordList'      : 'dbobjects',
+    'CompactDbrecord'   : 'dbobjects',
+    'CompactDbrecordList' : 'dbobjects',
+    'record_class'      : 'dbobjects',
+    # schema
+    'DbSchema'          : 'schema',
+    # dbpointers
+    'DbrecordPtr'       : 'dbpointers',
+    'DbrecordPtrList'   : 'dbpointers',
+    'AttribDbptr'       : 'dbpointers',
+    'DbTransaction'     : 'dbpointers',
+    # utils
+    'add_antelope_path' : 'utils',
+    'open_db_or_string' : 'utils',
+    'DbPool'            : 'utils',
+    'dbpool'            : 'utils',
+    })
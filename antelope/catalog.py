@@ -0,0 +1,313 @@
+#! /usr/bin/env python
+#
+# catalog.py
+#
+# obspy antelope catalog module
+#
+# Contains a converter from the event tables of an Antelope Datascope css3.0
+# database (origin, event, netmag, arrival, assoc, fplane) to an ObsPy
+# Catalog, for writing QuakeML (see anss.quakeml).
+#
+# The origins are joined to each of the other tables and each joined view is
+# read once, as columns (see DbSchema.structured), then the rows are matched
+# up by id in Python, instead of walking joins record by record.
+
+from numpy import sort, unique
+from obspy.core import UTCDateTime
+from obspy.core.event import (Catalog, Event, Origin, OriginQuality, Arrival,
+    Pick, WaveformStreamID, Magnitude, FocalMechanism, NodalPlanes,
+    NodalPlane, EventDescription, CreationInfo, ResourceIdentifier)
+from obspy_ext.antelope.utils import add_antelope_path, open_db_or_string, dbpool
+from obspy_ext.antelope.schema import DbSchema
+from obspy_ext.antelope.query import DbQuery
+add_antelope_path()
+from antelope.datascope import *  # all is necessary for db query variables
+
+# Fields read from each table
+FIELDS = {
+    'origin' : ('orid', 'evid', 'time', 'lat', 'lon', 'depth', 'nass', 'ndef',
+                'mb', 'mbid', 'ms', 'msid', 'ml', 'mlid', 'auth'),
+    'event'  : ('evid', 'evname', 'prefor', 'auth'),
+    'netmag' : ('magid', 'orid', 'magtype', 'nsta', 'magnitude', 'uncertainty',
+                'auth'),
+    'assoc'  : ('arid', 'orid', 'phase', 'delta', 'esaz', 'timeres', 'wgt'),
+    'arrival': ('arid', 'sta', 'chan', 'time', 'iphase', 'azimuth', 'fm',
+                'qual', 'auth'),
+    'fplane' : ('mechid', 'orid', 'str1', 'dip1', 'rake1', 'str2', 'dip2',
+                'rake2', 'auth'),
+    }
+
+# css3.0 null values of the numeric fields used (strings are '-')
+NULLS = {
+    'evid': -1, 'prefor': -1, 'lat': -999., 'lon': -999., 'depth': -999.,
+    'nass': -1, 'ndef': -1, 'mb': -999., 'mbid': -1, 'ms': -999., 'msid': -1,
+    'ml': -999., 'mlid': -1, 'nsta': -1, 'magnitude': -999.,
+    'uncertainty': -1., 'delta': -1., 'esaz': -1., 'timeres': -999.,
+    'wgt': -1., 'azimuth': -1., 'str1': -999., 'dip1': -999., 'rake1': -999.,
+    'str2': -999., 'dip2': -999., 'rake2': -999.,
+    }
+
+ONSETS = {'i': 'impulsive', 'e': 'emergent', 'w': 'questionable'}
+POLARITIES = {'c': 'positive', 'u': 'positive', 'd': 'negative',
+              'r': 'negative'}
+
+
+def _value(row, field):
+    """Value of a field of a row, None if null"""
+    value = row[field]
+    if value == NULLS.get(field, '-'):
+        return None
+    return value
+
+
+def _load(origin, table, through=(), key=None):
+    """
+    Rows of a table which go with a view of origins, as a list of dicts.
+
+    The origins are joined to the table (through the 'through' tables
+    first, e.g. assoc for arrival) and the joined view is read once, in
+    one columnar pass, so only the rows of those origins are ever read.
+
+    :type origin: antelope.datascope.Dbptr
+    :param origin: View of the origins
+    :type through: tuple
+    :param through: Tables to join on the way to the table
+    :type key: str
+    :param key: Field to keep only the first row of each value of, for
+        tables with rows shared by several origins (event, arrival)
+    """
+    tables = tuple(through) + (table,)
+    for name in tables:
+        if not dblookup(origin, table=name).query(dbTABLE_PRESENT):
+            return []
+    view = DbQuery(origin)
+    for name in tables:
+        view = view.join(name)
+    view = view.run()
+    fields = FIELDS[table]
+    data = DbSchema(view).structured(view, ['{0}.{1}'.format(table, field)
+                                            for field in fields])
+    if key is not None and len(data):
+        first = unique(data['{0}.{1}'.format(table, key)], return_index=True)[1]
+        data = data[sort(first)]
+    return [dict(zip(fields, row)) for row in data.tolist()]
+
+
+def _group(rows, field):
+    """Dict of value of a field -> list of rows with it, in row order"""
+    groups = {}
+    for row in rows:
+        groups.setdefault(row[field], []).append(row)
+    return groups
+
+
+class _Builder(object):
+    """Makes the ObsPy objects of one event from rows of the tables"""
+    def __init__(self, prefix):
+        self.prefix = prefix
+
+    def rid(self, kind, value):
+        return ResourceIdentifier('{0}/{1}/{2}'.format(self.prefix, kind, value))
+
+    @staticmethod
+    def creation_info(row):
+        auth = _value(row, 'auth')
+        if auth is None:
+            return None
+        return CreationInfo(author=auth)
+
+    def origin(self, row, assocs):
+        depth = _value(row, 'depth')
+        origin = Origin(resource_id=self.rid('origin', row['orid']),
+                        time=UTCDateTime(row['time']),
+                        latitude=_value(row, 'lat'),
+                        longitude=_value(row, 'lon'),
+                        depth=None if depth is None else depth * 1000.,
+                        creation_info=self.creation_info(row))
+        quality = OriginQuality(associated_phase_count=_value(row, 'nass'),
+                                used_phase_count=_value(row, 'ndef'))
+        origin.quality = quality
+        for assoc in assocs:
+            origin.arrivals.append(Arrival(
+                resource_id=self.rid('arrival', '{0}/{1}'.format(row['orid'], assoc['arid'])),
+                pick_id=self.rid('pick', assoc['arid']),
+                phase=_value(assoc, 'phase'),
+                azimuth=_value(assoc, 'esaz'),
+                distance=_value(assoc, 'delta'),
+                time_residual=_value(assoc, 'timeres'),
+                time_weight=_value(assoc, 'wgt')))
+        return origin
+
+    def pick(self, row):
+        fm = _value(row, 'fm') or '-'
+        qual = _value(row, 'qual') or '-'
+        return Pick(resource_id=self.rid('pick', row['arid']),
+                    time=UTCDateTime(row['time']),
+                    waveform_id=WaveformStreamID(station_code=row['sta'],
+                                                 channel_code=row['chan']),
+                    phase_hint=_value(row, 'iphase'),
+                    backazimuth=_value(row, 'azimuth'),
+                    onset=ONSETS.get(qual[0]),
+                    polarity=POLARITIES.get(fm[0]),
+                    creation_info=self.creation_info(row))
+
+    def magnitude(self, row, origin_id):
+        return Magnitude(resource_id=self.rid('magnitude', row['magid']),
+                         mag=_value(row, 'magnitude'),
+                         magnitude_type=_value(row, 'magtype'),
+                         origin_id=origin_id,
+                         station_count=_value(row, 'nsta'),
+                         creation_info=self.creation_info(row))
+
+    def origin_magnitudes(self, row, origin_id):
+        """Magnitudes from the mb/ms/ml columns of an origin row"""
+        mags = []
+        for magtype in ('mb', 'ms', 'ml'):
+            mag = _value(row, magtype)
+            if mag is None:
+                continue
+            magid = _value(row, magtype + 'id')
+            if magid is None:
+                magid = '{0}/{1}'.format(row['orid'], magtype)
+            mags.append(Magnitude(resource_id=self.rid('magnitude', magid),
+                                  mag=mag, magnitude_type=magtype,
+                                  origin_id=origin_id,
+                                  creation_info=self.creation_info(row)))
+        return mags
+
+    def focal_mechanism(self, row, origin_id):
+        planes = NodalPlanes(
+            nodal_plane_1=NodalPlane(strike=_value(row, 'str1'),
+                dip=_value(row, 'dip1'), rake=_value(row, 'rake1')),
+            nodal_plane_2=NodalPlane(strike=_value(row, 'str2'),
+                dip=_value(row, 'dip2'), rake=_value(row, 'rake2')))
+        return FocalMechanism(resource_id=self.rid('focalmechanism', row['mechid']),
+                              triggering_origin_id=origin_id,
+                              nodal_planes=planes,
+                              creation_info=self.creation_info(row))
+
+
+def _events(tables, prefix):
+    """
+    Generate Events from the loaded table rows, one at a time, in order of
+    the time of their first origin.
+    """
+    build = _Builder(prefix)
+    events = dict([(row['evid'], row) for row in tables['event']])
+    netmags = _group(tables['netmag'], 'orid')
+    assocs = _group(tables['assoc'], 'orid')
+    fplanes = _group(tables['fplane'], 'orid')
+    arrivals = dict([(row['arid'], row) for row in tables['arrival']])
+    # Origins of each event, origins with no event are events of their own
+    groups = []
+    index = {}
+    for row in tables['origin']:
+        evid = _value(row, 'evid')
+        if evid is None:
+            groups.append((None, [row]))
+        elif evid in index:
+            groups[index[evid]][1].append(row)
+        else:
+            index[evid] = len(groups)
+            groups.append((evid, [row]))
+    groups.sort(key=lambda g: min([row['time'] for row in g[1]]))
+    for evid, origins in groups:
+        if evid is None:
+            event = Event(resource_id=build.rid('event', 'orid/{0}'.format(origins[0]['orid'])))
+            ev = {}
+        else:
+            event = Event(resource_id=build.rid('event', evid))
+            ev = events.get(evid, {})
+        if ev:
+            if _value(ev, 'evname') is not None:
+                event.event_descriptions.append(
+                    EventDescription(text=ev['evname'], type='earthquake name'))
+            event.creation_info = build.creation_info(ev)
+        prefor = _value(ev, 'prefor') if ev else None
+        if prefor is None or prefor not in [row['orid'] for row in origins]:
+            prefor = origins[0]['orid']
+        picks = set()
+        for row in origins:
+            orid = row['orid']
+            _assocs = assocs.get(orid, [])
+            origin = build.origin(row, _assocs)
+            event.origins.append(origin)
+            for assoc in _assocs:
+                if assoc['arid'] in arrivals and assoc['arid'] not in picks:
+                    picks.add(assoc['arid'])
+                    event.picks.append(build.pick(arrivals[assoc['arid']]))
+            if orid in netmags:
+                mags = [build.magnitude(m, origin.resource_id) for m in netmags[orid]]
+            else:
+                mags = build.origin_magnitudes(row, origin.resource_id)
+            event.magnitudes.extend(mags)
+            for fplane in fplanes.get(orid, []):
+                event.focal_mechanisms.append(
+                    build.focal_mechanism(fplane, origin.resource_id))
+            if orid == prefor:
+                event.preferred_origin_id = origin.resource_id
+                if mags:
+                    event.preferred_magnitude_id = mags[0].resource_id
+        yield event
+
+
+def db2catalog(database, starttime=None, endtime=None, subset=None,
+               prefix='smi:local', quakeml=None, **kwargs):
+    """
+    Convert the event tables of a css3.0 database to an ObsPy Catalog.
+
+    Reads the origins (in a time window and/or subset, if given), then the
+    event, netmag, assoc, arrival and fplane rows which go with them, each
+    from a join with the origins, read in one columnar pass. Events are then built from the rows, with
+    their origins (and arrivals), picks, magnitudes (netmag, or the origin
+    mb/ms/ml) and focal mechanisms, and the preferred origin (prefor) and
+    magnitude set. Resource ids are PREFIX/kind/id, e.g. smi:local/origin/12.
+
+    :type database: string or antelope.datascope.Dbptr
+    :param database: Antelope database name or pointer
+    :type starttime: :class: `~obspy.core.utcdatetime.UTCDateTime`
+    :param starttime: Only origins from this time on
+    :type endtime: :class: `~obspy.core.utcdatetime.UTCDateTime`
+    :param endtime: Only origins before this time
+    :type subset: str
+    :param subset: Datascope expression to subset the origin table by
+    :type prefix: str
+    :param prefix: Prefix of the resource ids
+    :type quakeml: str
+    :param quakeml: Stream the events straight into a QuakeML file of this
+        name as they are built (see anss.quakeml.streamNamespaceQuakeML,
+        which gets any other kwargs) instead of returning a Catalog.
+    :rtype: :class:`~obspy.core.event.Catalog` or int
+    :return: Catalog of the events, or the number of events written
+
+    .. rubric:: Example
+
+    >>> cat = db2catalog('/opt/antelope/data/db/demo/demo',
+    ...                  starttime=UTCDateTime(1992, 5, 17))
+    >>> n = db2catalog('/opt/antelope/data/db/demo/demo', quakeml='demo.xml',
+    ...                attributes={'catalog': {'datasource': 'XX'}})
+    """
+    db, opened = open_db_or_string(database)
+    try:
+        origin = DbQuery(dblookup(db, table='origin')).where(subset)
+        origin = origin.between(starttime, endtime).run()
+        fields = FIELDS['origin']
+        data = DbSchema(origin).structured(origin, fields)
+        tables = {'origin': [dict(zip(fields, row)) for row in data.tolist()]}
+        if len(data):
+            tables['event'] = _load(origin, 'event', key='evid')
+            tables['netmag'] = _load(origin, 'netmag')
+            tables['fplane'] = _load(origin, 'fplane')
+            tables['assoc'] = _load(origin, 'assoc')
+            tables['arrival'] = _load(origin, 'arrival', ('assoc',), key='arid')
+        else:
+            for table in ('event', 'netmag', 'fplane', 'assoc', 'arrival'):
+                tables[table] = []
+    finally:
+        if opened:
+            dbpool.release(db)
+    events = _events(tables, prefix)
+    if quakeml is not None:
+        from obspy_ext.anss.quakeml import streamNamespaceQuakeML
+        return streamNamespaceQuakeML(events, quakeml, **kwargs)
+    return Catalog(events=list(events))
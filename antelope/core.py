@@ -7,16 +7,29 @@
 # Contains basic functions to interect with (read) data from Antelope
 # Datascope database tables into ObsPy using the Antelope Python interface.
 
-from numpy import array
-from obspy.core import read, Stream, UTCDateTime
-from obspy_ext.antelope.utils import add_antelope_path
-from obspy_ext.antelope.dbobjects import Dbrecord, DbrecordList 
+import os
+import re
+from bisect import bisect_left
+from collections import OrderedDict
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from numpy import array, empty, ones, result_type, dtype as np_dtype
+from numpy.ma import masked_array
+from obspy.core import read, Stream, Trace, UTCDateTime
+from obspy_ext.antelope.utils import add_antelope_path, dbpool
+from obspy_ext.antelope.dbobjects import (Dbrecord, DbrecordList,
+                                          CompactDbrecordList)
+from obspy_ext.antelope.schema import DbSchema
+from obspy_ext.antelope.query import DbQuery
+from obspy_ext.antelope.snapshot import take_snapshot
+from obspy_ext.antelope.wfdisc import (DTYPES, sample_range, chunk_range,
+                                       read_raw, file_stamp, WfdiscIndex)
 # Antelope path to python tools not added by default install
 add_antelope_path()               # adds path if not there
 from antelope.datascope import *  # all is necessary for db query variables
 
 
-def db2object(dbv):
+def db2object(dbv, compact=False, snapshot=None):
     """
     Port of Antelope MATLAB toolbox 'db2struct' function.
         
@@ -25,6 +38,11 @@ def db2object(dbv):
     
     :type dbv: antelope.datascope.Dbptr
     :param dbv: Open pointer to an Antelope database view or table
+    :type compact: bool
+    :param compact: Return a memory-saving CompactDbrecordList instead
+    :type snapshot: bool or str
+    :param snapshot: Take the values from an on-disk snapshot, see
+        to_structured
     :rtype: :class:`~obspy.antelope.Dbview`
     :return: Dbview of Dbrecord objeccts
     """
@@ -32,10 +50,586 @@ def db2object(dbv):
         db = Dbptr(dbv)
     else:
         raise TypeError("'{0}' is not a Dbptr object".format(dbv))
-    return DbrecordList(db)
+    rows = None
+    if snapshot:
+        rows = _snapshot(db, snapshot).rows()
+    if compact:
+        return CompactDbrecordList(db, rows)
+    return DbrecordList(db, rows)
 
-    
-def readANTELOPE(database, station=None, channel=None, starttime=None, endtime=None):
+
+def _snapshot(db, snapshot):
+    """Current Snapshot of a view, for the 'snapshot' option of loads"""
+    if snapshot is True:
+        snapshot = None
+    return take_snapshot(db, name=snapshot)
+
+
+def to_structured(dbv, fields=None, snapshot=None):
+    """
+    Load a table or view into one numpy structured array.
+
+    Columnar counterpart of db2object: each field is a typed column (float
+    times and reals, int ids, fixed width strings) taken from the schema,
+    and rows are copied straight into a preallocated array with one getv
+    each, so no Python object is kept per record.
+
+    :type dbv: antelope.datascope.Dbptr
+    :param dbv: Open pointer to an Antelope database view or table
+    :type fields: list
+    :param fields: Names of fields to load (default: all fields)
+    :type snapshot: bool or str
+    :param snapshot: Load from an on-disk snapshot of the table (True) or
+        of a view (its snapshot name), made now if missing or out of date.
+        See snapshot.take_snapshot.
+    :rtype: numpy.ndarray
+    :return: Structured array with one element per record
+
+    .. rubric:: Example
+
+    >>> db = dbopen('demo','r')
+    >>> db = db.lookup(table='origin')
+    >>> origins = to_structured(db, ['lat', 'lon', 'depth', 'time', 'orid'])
+    >>> deep = origins[origins['depth'] > 100.]
+    """
+    if isinstance(dbv, Dbptr):
+        db = Dbptr(dbv)
+    else:
+        raise TypeError("'{0}' is not a Dbptr object".format(dbv))
+    if snapshot:
+        return _snapshot(db, snapshot).to_structured(fields)
+    return DbSchema(db).structured(db, fields)
+
+
+def _raw_params(dbr):
+    """
+    Values needed to decode a wfdisc row directly, or None if its datatype
+    has to go through obspy.core.read.
+    """
+    if dbr.datatype in DTYPES:
+        return (dbr.datatype, dbr.foff, dbr.nsamp, dbr.samprate,
+                dbr.time, dbr.calib)
+    return None
+
+
+def _plan_reads(db, starttime=None, endtime=None, recnos=None):
+    """
+    Group the records of a wfdisc view by the file each one points to.
+
+    Returns a list of Dbrecords, one per record of the view in record order
+    (or for each of 'recnos', if given), and an OrderedDict keyed by file
+    name (in order of first appearance) holding a list of
+    (index into records, (sta, chan, t0, t1, raw)) windows to cut from
+    that file. 'raw' is (datatype, foff, nsamp, samprate, time, calib)
+    for rows which can be decoded directly, or None.
+    """
+    if recnos is None:
+        recnos = range(db.nrecs())
+    records = []
+    plan = OrderedDict()
+    schema = DbSchema(db)
+    for recno in recnos:
+        db.record = int(recno)
+        fname = db.filename()
+        dbr = Dbrecord(db, schema)
+        t0 = UTCDateTime(dbr.time)
+        t1 = UTCDateTime(dbr.endtime)
+        if starttime is not None and dbr.time < starttime.timestamp:
+            t0 = starttime
+        if endtime is not None and dbr.endtime > endtime.timestamp:
+            t1 = endtime
+        window = (dbr.sta, dbr.chan, t0, t1, _raw_params(dbr))
+        plan.setdefault(fname, []).append((len(records), window))
+        records.append(dbr)
+    return records, plan
+
+
+def _read_raw_trace(fname, sta, chan, t0, t1, raw, cache=None):
+    """
+    Decode the samples of one raw wfdisc segment in a window into a Trace.
+    """
+    datatype, foff, nsamp, samprate, time, calib = raw
+    first, last = sample_range(time, samprate, nsamp,
+                               t0.timestamp, t1.timestamp)
+    if cache is not None:
+        data = cache.read(fname, datatype, foff, first, last)
+    else:
+        data = read_raw(fname, datatype, foff, first, last)
+    header = {'station': sta, 'channel': chan, 'sampling_rate': samprate,
+              'starttime': UTCDateTime(time + first / samprate),
+              'calib': calib}
+    return Trace(data=data, header=header)
+
+
+def _read_file(task):
+    """
+    Read one waveform file once and cut out every window wanted from it.
+
+    Windows of raw datatypes (see wfdisc.DTYPES) are decoded directly from
+    their foff, only reading the samples in the window. Anything else is
+    read once for the whole file with obspy.core.read.
+
+    :type task: tuple
+    :param task: (file name, list of (sta, chan, t0, t1, raw) windows,
+        WaveformCache for the raw windows or None)
+    :rtype: list
+    :return: One Stream per window, in the order the windows were given
+    """
+    fname, windows, cache = task
+    cuts = [None] * len(windows)
+    sniff = []
+    for n, (sta, chan, t0, t1, raw) in enumerate(windows):
+        if raw is None:
+            sniff.append(n)
+        else:
+            tr = _read_raw_trace(fname, sta, chan, t0, t1, raw, cache)
+            cuts[n] = Stream([tr])
+    if sniff:
+        t0 = min([windows[n][2] for n in sniff])
+        t1 = max([windows[n][3] for n in sniff])
+        fst = read(fname, starttime=t0, endtime=t1)     # add format?
+        for n in sniff:
+            sta, chan, _t0, _t1, raw = windows[n]
+            _st = fst.select(station=sta, channel=chan) #not location aware
+            cuts[n] = _st.slice(_t0, _t1)
+    return cuts
+
+
+def _map_reads(tasks, workers=None, cache=None):
+    """
+    Run _read_file over a list of (file name, windows) tasks, in parallel
+    if workers > 1.
+
+    Files holding only raw datatypes are I/O bound and go to a thread pool,
+    files that have to be decoded by ObsPy (miniSEED, etc) go to a process
+    pool. Results come back in the same order as the tasks. The cache is
+    only used in this process, so not by the process pool.
+    """
+    if not workers or workers < 2 or len(tasks) < 2:
+        return [_read_file((fname, windows, cache)) for fname, windows in tasks]
+    results = [None] * len(tasks)
+    raw = [n for n, (fname, windows) in enumerate(tasks)
+           if all([w[4] is not None for w in windows])]
+    decode = sorted(set(range(len(tasks))) - set(raw))
+    pools = []
+    try:
+        if decode:
+            ppool = Pool(min(workers, len(decode)))
+            pools.append(ppool)
+            pending = ppool.map_async(_read_file,
+                                      [tasks[n] + (None,) for n in decode])
+        if raw:
+            tpool = ThreadPool(min(workers, len(raw)))
+            pools.append(tpool)
+            _tasks = [tasks[n] + (cache,) for n in raw]
+            for n, cuts in zip(raw, tpool.map(_read_file, _tasks)):
+                results[n] = cuts
+        if decode:
+            for n, cuts in zip(decode, pending.get()):
+                results[n] = cuts
+    except:
+        for pool in pools:
+            pool.terminate()
+        raise
+    for pool in pools:
+        pool.close()
+        pool.join()
+    return results
+
+
+def _wfdisc_view(database, station=None, channel=None, starttime=None,
+                 endtime=None, index=None):
+    """
+    Open (if needed) and subset a wfdisc view for a read.
+
+    Returns a Dbptr to the rows matching the station/channel expressions
+    and overlapping the time window, if given, and None. If a WfdiscIndex
+    is given, the view is left alone and the matching record numbers are
+    looked up in the index and returned instead of None. An index with a
+    stamp which doesn't match the wfdisc file any more (rows added or
+    changed since it was built), or used with a pointer to a view (subset,
+    sort, etc.) instead of the table, raises a ValueError, as its record
+    numbers would point at the wrong rows.
+
+    Databases given by name come from the shared pool, hand them back with
+    _release when done with the view.
+    """
+    if isinstance(database,Dbptr):
+        db = Dbptr(database)
+    elif isinstance(database,str):
+        db = dbpool.acquire(database, 'r')
+        db = dblookup(db,table='wfdisc')
+    else:
+        raise TypeError("Must input a string or pointer to a valid database")
+        
+    try:
+        if index is not None:
+            if db.query(dbTABLE_IS_VIEW):
+                raise ValueError("An index holds record numbers of the wfdisc "
+                                 "table, give the table, not a view of it")
+            table = dblookup(db, table='wfdisc').query(dbTABLE_FILENAME)
+            if index.stamp is not None and index.stamp != file_stamp(table):
+                raise ValueError("Index is out of date with '{0}', rebuild it "
+                                 "with wfdisc_index".format(table))
+            recnos = index.query(station, channel, starttime, endtime)
+            assert len(recnos) != 0, "No records for given time period"
+            return db, recnos
+        q = DbQuery(db).match(sta=station, chan=channel)
+        if starttime is not None and endtime is not None:
+            q = q.between(starttime, endtime, end='endtime')
+        db = q.run()
+        assert db.nrecs() != 0, "No records for given time period"
+    except:
+        _release(database, db)
+        raise
+    return db, None
+
+
+def _release(database, db):
+    """Give a db back to the pool, if it was opened from a name"""
+    if isinstance(database,str):
+        dbpool.release(db)
+
+
+def wfdisc_index(database, sidecar=True):
+    """
+    Build a WfdiscIndex over a wfdisc table, for the 'index' of reads.
+
+    With 'sidecar', the index is saved next to the table file (as
+    'db.wfdisc.idx.npz') and loaded from there next time, as long as the
+    mtime and size of the wfdisc file still match. Otherwise the columns
+    are read from the table, in one pass, and a fresh index is built.
+
+    :type database: string or antelope.datascope.Dbptr
+    :param database: Antelope database name, or pointer to a wfdisc TABLE
+    :type sidecar: bool
+    :param sidecar: Use and update the sidecar file
+    :rtype: :class:`~obspy_ext.antelope.wfdisc.WfdiscIndex`
+
+    .. rubric:: Example
+
+    >>> index = wfdisc_index('/Volumes/colza_HD/dbs/land')
+    >>> st = readANTELOPE('/Volumes/colza_HD/dbs/land', station='TOL0',
+    ...     starttime=UTCDateTime(2008,6,13), endtime=UTCDateTime(2008,6,14),
+    ...     index=index)
+    """
+    db, recnos = _wfdisc_view(database)
+    try:
+        table = db.query(dbTABLE_FILENAME)
+        stamp = file_stamp(table)
+        fname = table + '.idx.npz'
+        if sidecar and os.path.exists(fname):
+            try:
+                index = WfdiscIndex.load(fname)
+            except Exception:
+                index = None
+            if index is not None and index.stamp == stamp:
+                return index
+        rows = [db.getv('sta', 'chan', 'time', 'endtime')
+                for db.record in range(db.nrecs())]
+    finally:
+        _release(database, db)
+    sta, chan, time, endtime = zip(*rows)
+    index = WfdiscIndex(sta, chan, time, endtime, stamp=stamp)
+    if sidecar:
+        try:
+            index.save(fname)
+        except (IOError, OSError):
+            pass  # read-only database dir, just don't cache it
+    return index
+
+
+def _read_plan(records, plan, workers=None, cache=None):
+    """
+    Read every window of a plan from _plan_reads into one Stream.
+
+    Traces come back in record order, each with its Dbrecord as 'db'.
+    """
+    tasks = [(fname, [window for n, window in rows])
+             for fname, rows in plan.items()]
+    streams = [None] * len(records)
+    for rows, cuts in zip(plan.values(), _map_reads(tasks, workers, cache)):
+        for (n, window), _st in zip(rows, cuts):
+            if len(_st):
+                _st[0].db = records[n]
+            streams[n] = _st
+    st = Stream()
+    for _st in streams:
+        if _st is not None:
+            st += _st
+    return st
+
+
+def _assemble_plan(records, plan, workers=None, cache=None):
+    """
+    Read every window of a plan from _plan_reads into one Trace per channel.
+
+    The span of each (net, sta, loc, chan) is planned from the windows
+    first, then one array is allocated for it and each segment is decoded
+    straight into its slot: raw datatypes from their foff, anything else
+    by ObsPy (in parallel if workers > 1) and copied in. Samples no segment
+    covers are masked (and zeroed). Where segments overlap, the later row
+    wins. Each Trace gets the list of Dbrecords it was built from as 'db'.
+
+    wfdisc rows carry no network or location, so raw segments have empty
+    ones. Segments of a channel with different sampling rates are kept in
+    separate Traces.
+    """
+    # (net, sta, loc, chan, samprate) -> [(start, npts, source, record #)],
+    # where source is an array of samples or raw read_raw arguments
+    pieces = {}
+    tasks = []
+    decode = []
+    for fname, rows in plan.items():
+        _rows = [(n, window) for n, window in rows if window[4] is None]
+        if _rows:
+            tasks.append((fname, [window for n, window in _rows]))
+            decode.append(_rows)
+        for n, (sta, chan, t0, t1, raw) in rows:
+            if raw is None:
+                continue
+            datatype, foff, nsamp, samprate, time, calib = raw
+            first, last = sample_range(time, samprate, nsamp,
+                                       t0.timestamp, t1.timestamp)
+            if last > first:
+                key = ('', sta, '', chan, samprate)
+                source = (fname, datatype, foff, first, last)
+                pieces.setdefault(key, []).append(
+                    (time + first / samprate, last - first, source, n))
+    for _rows, cuts in zip(decode, _map_reads(tasks, workers)):
+        for (n, window), _st in zip(_rows, cuts):
+            for tr in _st:
+                s = tr.stats
+                if not s.npts:
+                    continue
+                key = (s.network, s.station, s.location, s.channel,
+                       s.sampling_rate)
+                pieces.setdefault(key, []).append(
+                    (s.starttime.timestamp, s.npts, tr.data, n))
+    traces = []
+    for key, parts in pieces.items():
+        net, sta, loc, chan, samprate = key
+        parts.sort(key=lambda p: p[3])
+        start = min([p[0] for p in parts])
+        slots = [int(round((p[0] - start) * samprate)) for p in parts]
+        npts = max([i + p[1] for i, p in zip(slots, parts)])
+        dtypes = [np_dtype(DTYPES[p[2][1]]).newbyteorder('=')
+                  if isinstance(p[2], tuple) else p[2].dtype for p in parts]
+        data = empty(npts, dtype=result_type(*dtypes))
+        gaps = ones(npts, dtype=bool)
+        for i, (t, count, source, n) in zip(slots, parts):
+            if not isinstance(source, tuple):
+                data[i:i + count] = source
+            elif cache is not None:
+                data[i:i + count] = cache.read(*source)
+            else:
+                read_raw(*source, out=data[i:i + count])
+            gaps[i:i + count] = False
+        if gaps.any():
+            data[gaps] = 0
+            data = masked_array(data, mask=gaps)
+        header = {'network': net, 'station': sta, 'location': loc,
+                  'channel': chan, 'sampling_rate': samprate,
+                  'starttime': UTCDateTime(start),
+                  'calib': records[parts[0][3]].calib}
+        tr = Trace(data=data, header=header)
+        tr.db = DbrecordList()
+        tr.db.extend([records[p[3]] for p in parts])
+        traces.append((parts[0][3], tr))
+    traces.sort(key=lambda x: x[0])
+    return Stream([tr for n, tr in traces])
+
+
+def _chunk_plan(records, plan, c0, c1):
+    """
+    Cut a plan from _plan_reads down to the windows inside [c0, c1).
+
+    Windows are cut on the samples of each row (see wfdisc.chunk_range),
+    ending on the last sample before the first one at or after c1, so
+    consecutive chunks return every sample exactly once.
+    """
+    chunk = OrderedDict()
+    for fname, rows in plan.items():
+        for n, (sta, chan, t0, t1, raw) in rows:
+            dbr = records[n]
+            first, last = chunk_range(dbr.time, dbr.samprate, dbr.nsamp,
+                                      c0.timestamp, c1.timestamp)
+            if last <= first:
+                continue
+            t0 = max(t0, UTCDateTime(dbr.time + first / dbr.samprate))
+            t1 = min(t1, UTCDateTime(dbr.time + (last - 1) / dbr.samprate))
+            if t0 <= t1:
+                window = (sta, chan, t0, t1, raw)
+                chunk.setdefault(fname, []).append((n, window))
+    return chunk
+
+
+def iter_antelope(database, station=None, channel=None, starttime=None,
+                  endtime=None, chunk=None, workers=None, index=None,
+                  cache=None):
+    """
+    Iterate over a portion of an Antelope wfdisc table without loading it all.
+
+    Takes the same arguments as readANTELOPE (including 'index' and
+    'cache'). With no 'chunk', yields a Trace (with its 'db' Dbrecord) for
+    each row as soon as its file is decoded, one file at a time, so rows
+    sharing a file come out together.
+
+    With 'chunk' seconds, steps through the requested time span (or the
+    span of the rows if no times are given) and yields a Stream holding
+    every channel for one chunk at a time. Peak memory is then about one
+    chunk per channel, whatever the length of the request.
+
+    :type chunk: float
+    :param chunk: Length of time chunks to yield, in seconds
+    :rtype: generator
+    :return: Traces, or Streams of one chunk each
+
+    .. rubric:: Example
+
+    >>> for st in iter_antelope('/Volumes/colza_HD/dbs/land', station='TOL0',
+    ...         starttime=UTCDateTime(2008,6,1), endtime=UTCDateTime(2008,7,1),
+    ...         chunk=3600):
+    ...     detect(st)
+    """
+    db, recnos = _wfdisc_view(database, station, channel, starttime, endtime,
+                              index)
+    try:
+        records, plan = _plan_reads(db, starttime, endtime, recnos)
+    finally:
+        _release(database, db)
+    if chunk is None:
+        for fname, rows in plan.items():
+            cuts = _read_file((fname, [window for n, window in rows], cache))
+            for (n, window), _st in zip(rows, cuts):
+                if len(_st):
+                    _st[0].db = records[n]
+                for tr in _st:
+                    yield tr
+        return
+    t0 = min([w[2] for rows in plan.values() for n, w in rows])
+    t1 = max([w[3] for rows in plan.values() for n, w in rows])
+    c0 = t0
+    while c0 <= t1:
+        c1 = c0 + chunk
+        _plan = _chunk_plan(records, plan, c0, c1)
+        if _plan:
+            yield _read_plan(records, _plan, workers, cache)
+        c0 = c1
+
+
+def cut_antelope(database, requests, workers=None, cache=None, index=None):
+    """
+    Cut many time windows out of an Antelope wfdisc table in one pass.
+
+    Instead of one readANTELOPE call (and one set of dbsubsets and file
+    reads) per window, the wfdisc is subset once for the requested
+    stations and channels over the whole time span (or the rows are
+    looked up in an index), every row is matched against all of the
+    requests, overlapping windows hitting the same row are merged, and
+    each file is read once. Requests sharing a read get their own copies
+    of the samples.
+
+    :type database: string or antelope.datascope.Dbptr
+    :param database: Antelope database name or pointer
+    :type requests: list
+    :param requests: (sta, chan, starttime, endtime) tuples, times as
+        UTCDateTime or epoch floats. sta and chan are matched exactly.
+    :type workers: int
+    :param workers: Number of files to read in parallel (see readANTELOPE)
+    :type cache: :class:`~obspy_ext.antelope.wfdisc.WaveformCache`
+    :param cache: Cache for raw datatype samples (see readANTELOPE)
+    :type index: :class:`~obspy_ext.antelope.wfdisc.WfdiscIndex`
+    :param index: Index of the wfdisc TABLE to look up rows in (see
+        readANTELOPE)
+    :rtype: list
+    :return: One Stream per request, in request order. Each Trace has the
+        Dbrecord of its wfdisc row as 'db'.
+
+    .. rubric:: Example
+
+    >>> picks = [('TOL0', 'BHZ', t - 5, t + 20) for t in arrival_times]
+    >>> templates = cut_antelope('/Volumes/colza_HD/dbs/land', picks)
+    """
+    requests = [(sta, chan, UTCDateTime(t0), UTCDateTime(t1))
+                for sta, chan, t0, t1 in requests]
+    streams = [Stream() for r in requests]
+    if not requests:
+        return streams
+    # Requested windows per channel, sorted by start time
+    by_channel = {}
+    for k, (sta, chan, t0, t1) in enumerate(requests):
+        by_channel.setdefault((sta, chan), []).append((t0.timestamp, t1.timestamp, k))
+    for windows in by_channel.values():
+        windows.sort()
+    ts = min([r[2] for r in requests])
+    te = max([r[3] for r in requests])
+    # Only the requested stations and channels, exact names as expressions
+    station = '|'.join([re.escape(sta) for sta in sorted(set([r[0] for r in requests]))])
+    channel = '|'.join([re.escape(chan) for chan in sorted(set([r[1] for r in requests]))])
+    db, recnos = _wfdisc_view(database, station, channel, ts, te, index)
+
+    records = {}
+    plan = OrderedDict()
+    cuts = []
+    try:
+        schema = DbSchema(db)
+        if recnos is None:
+            recnos = range(db.nrecs())
+        for recno in recnos:
+            db.record = int(recno)
+            sta, chan, time, endtime = db.getv('sta', 'chan', 'time', 'endtime')
+            windows = by_channel.get((sta, chan))
+            if not windows:
+                continue
+            hits = [(max(time, r0), min(endtime, r1), k)
+                    for r0, r1, k in windows[:bisect_left(windows, (endtime,))]
+                    if r1 > time]
+            if not hits:
+                continue
+            dbr = Dbrecord(db, schema)
+            records[db.record] = dbr
+            raw = _raw_params(dbr)
+            # Merge overlapping windows on this row into single reads
+            merged = []
+            for h0, h1, k in sorted(hits):
+                if merged and h0 <= merged[-1][1]:
+                    merged[-1][1] = max(merged[-1][1], h1)
+                else:
+                    merged.append([h0, h1])
+            fname = db.filename()
+            for m0, m1 in merged:
+                window = (sta, chan, UTCDateTime(m0), UTCDateTime(m1), raw)
+                plan.setdefault(fname, []).append((db.record, window))
+            for h0, h1, k in hits:
+                cuts.append((k, db.record, UTCDateTime(h0), UTCDateTime(h1)))
+    finally:
+        _release(database, db)
+
+    tasks = [(fname, [window for n, window in rows])
+             for fname, rows in plan.items()]
+    pieces = {}
+    for rows, _cuts in zip(plan.values(), _map_reads(tasks, workers, cache)):
+        for (n, window), _st in zip(rows, _cuts):
+            pieces.setdefault(n, Stream())
+            pieces[n] += _st
+    # Slices are views of the samples read for a row: copy them when the
+    # row serves more than one request, so the Streams don't share data
+    uses = {}
+    for k, n, t0, t1 in cuts:
+        uses[n] = uses.get(n, 0) + 1
+    for k, n, t0, t1 in cuts:
+        for tr in pieces[n].slice(t0, t1):
+            if uses[n] > 1:
+                tr = tr.copy()
+            if tr.stats.npts:
+                tr.db = records[n]
+                streams[k].append(tr)
+    return streams
+
+
+def readANTELOPE(database, station=None, channel=None, starttime=None, endtime=None,
+                 workers=None, index=None, cache=None, assemble=False):
     '''
     Reads a portion of a Antelope wfdisc table to a Stream.
     
@@ -46,6 +640,12 @@ def readANTELOPE(database, station=None, channel=None, starttime=None, endtime=N
     NOTE: Currently MUST have both times (start/end) or neither.
     the returned Traces will have a new attribute, 'db'
 
+    Records are grouped by the file they point to, so a multiplexed or
+    day-volume file is read only once per call, no matter how many rows
+    of the view reference it. Rows with a raw binary datatype (s4, i4, t4,
+    etc) are decoded straight from 'foff', reading only the samples in the
+    requested window.
+
     :type database: string or antelope.datascope.Dbptr
     :param database: Antelope database name or pointer
     :type station: string
@@ -56,6 +656,23 @@ def readANTELOPE(database, station=None, channel=None, starttime=None, endtime=N
     :param starttime: Desired start time
     :type endtime: :class: `~obspy.core.utcdatetime.UTCDateTime`
     :param endtime: Desired end time
+    :type workers: int
+    :param workers: Number of files to read in parallel (default: serial).
+        Raw datatype files are read in threads, others in processes.
+    :type index: :class:`~obspy_ext.antelope.wfdisc.WfdiscIndex`
+    :param index: Index of the wfdisc TABLE (see wfdisc_index) to look up
+        rows in, instead of subsetting the view with Datascope. Raises a
+        ValueError if the wfdisc file has changed since it was built, or
+        if 'database' is a pointer to a view rather than the table.
+    :type cache: :class:`~obspy_ext.antelope.wfdisc.WaveformCache`
+    :param cache: Opt-in cache of decoded raw datatype samples, so that
+        repeated or overlapping reads are served from memory.
+    :type assemble: bool
+    :param assemble: Return one contiguous Trace per channel instead of
+        one per row, decoding each row straight into its place in one
+        preallocated array (masked where there are gaps). Saves the copies
+        of a Stream.merge. The 'db' of each Trace is then a DbrecordList
+        of the rows it holds.
         
     :rtype: :class: `~obspy.core.stream.Stream'
     :return: Stream with one Trace for each row of the database view
@@ -77,47 +694,29 @@ def readANTELOPE(database, station=None, channel=None, starttime=None, endtime=N
     
     >>> st[0].db
     Dbrecord('View43' -> TOL0 LHE 1213229044.64::1213315451.64)
+
+    Or one Trace per channel, for the whole day
+
+    >>> st = readANTELOPE('/Volumes/colza_HD/dbs/land', station='TOL0', channel='LH.',
+                        starttime=UTCDateTime(2008,6,13), endtime=UTCDateTime(2008,6,14),
+                        assemble=True)
+    >>> print(st)
+    3 Trace(s) in Stream:
+    XA.TOL0..LHE | 2008-06-12T23:59:59.640000Z - 2008-06-13T23:59:59.640000Z | 1.0 Hz, 86401 samples
+    XA.TOL0..LHN | 2008-06-12T23:59:59.640000Z - 2008-06-13T23:59:59.640000Z | 1.0 Hz, 86401 samples
+    XA.TOL0..LHZ | 2008-06-12T23:59:59.640000Z - 2008-06-13T23:59:59.640000Z | 1.0 Hz, 86401 samples
  
     '''
-    if isinstance(database,Dbptr):
-        db = Dbptr(database)
-    elif isinstance(database,str):
-        db = dbopen(database, 'r')
-        db = dblookup(db,table='wfdisc')
-    else:
-        raise TypeError("Must input a string or pointer to a valid database")
-        
-    if station is not None:
-        db = dbsubset(db,'sta=~/{0}/'.format(station))
-    if channel is not None:
-        db = dbsubset(db,'chan=~/{0}/'.format(channel))
-    if starttime is not None and endtime is not None:
-        ts = starttime.timestamp
-        te = endtime.timestamp
-        db = dbsubset(db,'endtime > {0} && time < {1}'.format(ts,te) )
-    else:
-        ts = starttime
-        te = endtime
-    assert db.nrecs() is not 0, "No records for given time period"
-    
-    st = Stream()
-    for db.record in range(db.nrecs() ):
-        fname = db.filename() 
-        dbr = Dbrecord(db)
-        t0 = UTCDateTime(dbr.time)
-        t1 = UTCDateTime(dbr.endtime)
-        if dbr.time < ts:
-            t0 = starttime
-        if dbr.endtime > te:
-            t1 = endtime
-        _st = read(fname, starttime=t0, endtime=t1)         # add format?
-        _st = _st.select(station=dbr.sta, channel=dbr.chan) #not location aware
-        _st[0].db = dbr
-        st += _st
-    # Close what we opened, BUT garbage collection may take care of this:
-    # if you have an open pointer but pass db name as a string, global
-    # use of your pointer won't work if this is uncommented:
-    #
-    #if isinstance(database,str):
-    #    db.close()
+    db, recnos = _wfdisc_view(database, station, channel, starttime, endtime,
+                              index)
+    # Give back what we opened. The shared pool keeps it open (it never
+    # closes dbs on its own unless given a timeout/maxsize), so a pointer
+    # from the user's own dbopen of the same descriptor keeps working.
+    try:
+        records, plan = _plan_reads(db, starttime, endtime, recnos)
+    finally:
+        _release(database, db)
+    if assemble:
+        return _assemble_plan(records, plan, workers, cache)
+    st = _read_plan(records, plan, workers, cache)
     return st
@@ -14,10 +14,13 @@
 # databases for the classes to work properly. The advantage is speed and
 # memory footprint when working with large database tables.
 
-from obspy_ext.antelope.utils import add_antelope_path
+from obspy_ext.antelope.utils import add_antelope_path, dbpool
 add_antelope_path()
 from antelope.datascope import *  # all is necessary for db query variables
-from numpy import array
+from obspy_ext.antelope.schema import get_schema
+from obspy_ext.antelope.query import DbQuery
+from collections import OrderedDict
+from numpy import array, asarray, empty, flatnonzero
 
 
 class DbrecordPtr(dict, object):
@@ -28,42 +31,85 @@ class DbrecordPtr(dict, object):
     Useful for large datasets that may have trouble in memory
     Only stores the pointer, not contents, all attributes are
     returned by querying the open db using the pointer.
+
+    The schema (Table, PrimaryKey, Fields) is queried once per table and
+    shared by every DbrecordPtr into it. Optionally, field values can be
+    cached as they are read (cache=True); writes always go through to the
+    db, and invalidate() forgets cached values if the db changes under you.
+
+    Inside an active DbTransaction (see AttribDbptr.transaction), writes
+    are buffered in the transaction instead, and read back from it until
+    it is committed or rolled back.
     """
-    # Only holds one thing in Python namespace, Dbptr object:
+    # Holds the Dbptr object, plus the shared schema, optional cache and
+    # optional transaction:
     Ptr = Dbptr()
+    _schema = None
+    _values = None
+    _tx = None
+    _locals = ('Ptr', '_schema', '_values', '_tx')
 
     @property
     def Table(self):
-        return self.Ptr.query(dbTABLE_NAME)  # string of what table record came from
+        return self._schema.Table          # string of what table record came from
     @property
     def PrimaryKey(self):
-        return self.Ptr.query(dbPRIMARY_KEY) # tuple of strings of fields in primary key
+        return self._schema.PrimaryKey     # tuple of strings of fields in primary key
     @property
-    def _fields_unsorted(self):              # tuple of fields from database record
-        return self.Ptr.query(dbTABLE_FIELDS)
+    def _fields_unsorted(self):            # tuple of fields from database record
+        return self._schema.fields
     @property
     def Fields(self):
-        flist = list(self._fields_unsorted)
-        flist.sort()
-        return flist
+        return list(self._schema.Fields)
 
-    def __init__(self, db=None):
+    def __init__(self, db=None, schema=None, cache=False, tx=None):
         """
         Testing object relational mapper-type thing...
+
+        :type db: antelope.datascope.Dbptr
+        :param db: Pointer to one record
+        :type schema: DbSchema
+        :param schema: Schema of the view, if already queried
+        :type cache: bool
+        :param cache: Keep field values after reading them once
+        :type tx: DbTransaction
+        :param tx: Transaction to buffer writes in while it is active
         """
         if db:
             if db.record == dbALL:
                 raise ValueError("Rec # is 'dbALL', one record only, please.")
             self.Ptr = Dbptr(db)
+            self._schema = schema or get_schema(self.Ptr)
+            if cache:
+                self._values = {}
+            self._tx = tx
         else:
             self.Ptr = Dbptr()
             raise NotImplementedError("No empty contructor allowed here yet...")
 
+    def invalidate(self, field=None):
+        """Forget the cached value of a field, or all of them"""
+        if self._values is not None:
+            if field is None:
+                self._values.clear()
+            else:
+                self._values.pop(field, None)
+
     def __getattr__(self, field):
         """
         Looks for attributes in fields of a db pointer
         """
-        return self.Ptr.getv(field)[0]
+        if field.startswith('__'):
+            raise AttributeError(field)
+        if self._tx is not None and self._tx.active:
+            changes = self._tx.changes(self.Ptr.record)
+            if field in changes:
+                return changes[field]
+        if self._values is None:
+            return self.Ptr.getv(field)[0]
+        if field not in self._values:
+            self._values[field] = self.Ptr.getv(field)[0]
+        return self._values[field]
 
     def __setattr__(self, field, value):
         """Try to set a db field
@@ -71,13 +117,18 @@ class DbrecordPtr(dict, object):
         You must have opened your db with r+ permissions!
         """
         # Special case: trying to set the pointer. Else try to write to the db
-        if field == 'Ptr':
+        if field in self._locals:
             super(DbrecordPtr,self).__setattr__(field, value)
+        elif self._tx is not None and self._tx.active:
+            self._tx.set(self.Ptr.record, field, value)
+            self.invalidate(field)
         else:
            # Could try to catch an ElogComplain in else, but the same
            # error comes up for read-only or a wrong field
            # if self.Ptr.query(dbDATABASE_IS_WRITABLE):
            self.Ptr.putv(field, value)
+           if self._values is not None:
+               self._values[field] = value
 
     # Dictionary powers activate:
     __getitem__ = __getattr__
@@ -112,6 +163,104 @@ class DbrecordPtr(dict, object):
         return ' '.join(fields)
 
 
+def _pairs(fields):
+    """Flatten a dict of fields into the name, value, ... args of putv/addv"""
+    args = []
+    for item in fields.items():
+        args.extend(item)
+    return args
+
+
+class DbTransaction(object):
+    """
+    Local changes to a table or view, written to the db in one pass.
+
+    Field updates are buffered per record and new rows are queued, then
+    commit() writes each changed record with ONE multi-field putv and each
+    new row with one addv. If a write fails, or on rollback(), the buffer
+    is thrown away. Note Datascope itself can't undo rows that were already
+    written before the failing one.
+
+    Works as a context manager: commits on a clean exit and rolls back if
+    an exception is raised.
+
+    .. rubric:: Example
+    >>> db = dbopen('/opt/antelope/data/db/demo/demo', 'r+')
+    >>> origins = AttribDbptr(db, table='origin')
+    >>> with origins.transaction() as tx:
+    ...     for dbr in origins:
+    ...         dbr.lat, dbr.lon, dbr.depth = relocate(dbr)
+    ...     tx.add(lat=45.0, lon=-120.0, depth=5.0, time=t0, orid=9999)
+    """
+    def __init__(self, db):
+        """
+        :type db: antelope.datascope.Dbptr
+        :param db: Open (r+) pointer to the table or view to change
+        """
+        self.Ptr = Dbptr(db)
+        self.Ptr.record = dbALL
+        self.active = True
+        self._updates = OrderedDict()   # record # -> {field: value}
+        self._additions = []            # {field: value} of new rows
+
+    def __len__(self):
+        """Number of records to write"""
+        return len(self._updates) + len(self._additions)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+    def changes(self, record):
+        """Dict of buffered changes to a record"""
+        return self._updates.get(int(record), {})
+
+    def set(self, record, field, value):
+        """Buffer a change of one field of a record"""
+        self._updates.setdefault(int(record), OrderedDict())[field] = value
+
+    def update(self, record, **fields):
+        """Buffer changes of several fields of a record"""
+        for field in fields:
+            self.set(record, field, fields[field])
+
+    def add(self, **fields):
+        """Queue a new row, given as field=value keywords"""
+        self._additions.append(fields)
+
+    def rollback(self):
+        """Throw away all buffered changes, and end the transaction"""
+        self._updates.clear()
+        del self._additions[:]
+        self.active = False
+
+    def commit(self):
+        """
+        Write all buffered changes, and end the transaction.
+
+        :rtype: list
+        :return: Record numbers of the added rows
+        """
+        db = Dbptr(self.Ptr)
+        added = []
+        try:
+            for record, changes in self._updates.items():
+                db.record = record
+                db.putv(*_pairs(changes))
+            db.record = dbALL
+            for fields in self._additions:
+                added.append(db.addv(*_pairs(fields)))
+        finally:
+            self.rollback()
+        return added
+
+
 class DbrecordPtrList(list):
     """
     A list-like container of DbrecordPtr objects.
@@ -137,7 +286,8 @@ class DbrecordPtrList(list):
         super(DbrecordPtrList,self).__init__()
         if isinstance(dbv, Dbptr):
             db = Dbptr(dbv)
-            self.extend([DbrecordPtr(db) for db.record in range(db.nrecs())])
+            schema = get_schema(db)
+            self.extend([DbrecordPtr(db, schema) for db.record in range(db.nrecs())])
         elif isinstance(dbv,list):
             self.extend([x for x in dbv if isinstance(x,DbrecordPtr)])
         else:
@@ -148,7 +298,7 @@ class DbrecordPtrList(list):
     # may do funny things if you have records from different tables...
     def col(self, field):
         """A column of the same field from each Dbrecord"""
-        return [dbr[field] for dbr in self if field in dbr.Fields ]
+        return [dbr[field] for dbr in self if field in dbr._schema.field_set ]
 
     def acol(self, field):
         """A numpy array of the same field from each Dbrecord"""
@@ -191,36 +341,81 @@ class AttribDbptr(list):
     """
     Ptr = Dbptr() # the only data stored locally
     _opened = False # True if db was opened by __init__()
+    _schema = None  # schema of the view, queried on first use
+    _cache = False  # DbrecordPtr's cache their values
+    _tx = None      # current DbTransaction, see transaction()
 
-    def __init__(self, database=None, **kwargs):
+    def __init__(self, database=None, cache=False, **kwargs):
         """
         Sets the pointer.
 
         :type dbv: antelope.datascope.Dbptr
         :param dbv: Open pointer to an Antelope database view or table
+        :type cache: bool
+        :param cache: Records cache field values (see DbrecordPtr)
         """
         super(AttribDbptr,self).__init__()
         if isinstance(database, Dbptr):
             self.Ptr = Dbptr(database)
         elif isinstance(database, str):
-            db = dbopen(database,'r')
+            db = dbpool.acquire(database,'r')
             self.Ptr = db
             self._opened = True
         else:
             raise TypeError("Input pointer or string of valid database")
         if kwargs:
             self.Ptr = dblookup(self.Ptr,**kwargs)
+        self._cache = cache
             
         # otherwise returns empty list
 
     def __del__(self):
-        """Close the db if it was opened on creation
-        This is a weird and dangerous one but not having it
-        might be worse. Counting refs to db pointers is not
-        something I want to do, and...
+        """Give back the db if it was opened on creation
+
+        Dbs opened from a name come from the shared pool, which counts
+        references and only closes them once nobody is using them.
         """
         if self._opened:
-            self.Ptr.close()
+            dbpool.release(self.Ptr)
+
+    def transaction(self):
+        """
+        Start buffering writes to records of this view, see DbTransaction.
+
+        Records gotten from the view while the transaction is active buffer
+        their field assignments in it, instead of one putv each.
+
+        :rtype: DbTransaction
+        """
+        self._tx = DbTransaction(self.Ptr)
+        return self._tx
+
+    @property
+    def Schema(self):
+        """DbSchema of the view, queried once"""
+        if self._schema is None:
+            self._schema = get_schema(self.Ptr)
+        return self._schema
+
+    # Lazy queries, see DbQuery
+    def query(self):
+        """A DbQuery starting from this view"""
+        return DbQuery(self.Ptr, source=self)
+
+    def where(self, expression=None, **fields):
+        return self.query().where(expression, **fields)
+
+    def match(self, **fields):
+        return self.query().match(**fields)
+
+    def between(self, starttime=None, endtime=None, field='time', end=None):
+        return self.query().between(starttime, endtime, field, end)
+
+    def join(self, table, outer=False):
+        return self.query().join(table, outer)
+
+    def sort(self, *fields, **kwargs):
+        return self.query().sort(*fields, **kwargs)
 
     def __getitem__(self, index):
         """
@@ -231,11 +426,11 @@ class AttribDbptr(list):
             if 0 <= index < len(self):
                 dbp = Dbptr(self.Ptr)
                 dbp[3] = index
-                return DbrecordPtr(dbp)
+                return DbrecordPtr(dbp, self.Schema, self._cache, self._tx)
             elif -len(self) <= index < 0:
                 dbp = Dbptr(self.Ptr)
                 dbp[3] = len(self)+index
-                return DbrecordPtr(dbp)
+                return DbrecordPtr(dbp, self.Schema, self._cache, self._tx)
             else:
                 raise ValueError("Index out of range")
         elif isinstance(index,slice):
@@ -266,8 +461,59 @@ class AttribDbptr(list):
     # Convenience methods
     def col(self, field):
         """A column of the same field from each Dbrecord"""
-        return [dbr[field] for dbr in self if field in dbr.Fields ]
+        if field not in self.Schema.field_set:
+            return []
+        return [dbr[field] for dbr in self]
 
     def acol(self, field):
         """A numpy array of the same field from each Dbrecord"""
-        return array(self.col(field))
+        if field not in self.Schema.field_set:
+            return array([])
+        return self.columns(field)
+
+    def columns(self, *fields, **kwargs):
+        """
+        Typed numpy arrays of one or more fields, in one pass.
+
+        Walks the record numbers of the view with a single pointer and
+        fills preallocated arrays (typed from the schema, see DbSchema.dtype)
+        with one getv per record, without building a DbrecordPtr per row.
+
+        :type fields: str
+        :param fields: Names of the fields
+        :type rows: slice, boolean mask or array of record numbers
+        :param rows: keyword only, records to read (default: all)
+        :rtype: numpy.ndarray or tuple
+        :return: An array for one field, a tuple of arrays for several
+
+        .. rubric:: Example
+        >>> dbptr = AttribDbptr(db, table='site')
+        >>> lat, lon = dbptr.columns('lat', 'lon')
+        >>> sta = dbptr.columns('sta', rows=lat > 45.)
+        """
+        rows = kwargs.pop('rows', None)
+        if kwargs:
+            raise TypeError("Unexpected keyword(s): {0}".format(', '.join(kwargs)))
+        nrecs = len(self)
+        if rows is None:
+            recnos = range(nrecs)
+        elif isinstance(rows, slice):
+            recnos = range(*rows.indices(nrecs))
+        else:
+            rows = asarray(rows)
+            if rows.dtype == bool:
+                if len(rows) != nrecs:
+                    raise ValueError("Mask length doesn't match number of records")
+                recnos = flatnonzero(rows)
+            else:
+                recnos = rows
+        dtype = self.Schema.dtype(self.Ptr, fields)
+        out = [empty(len(recnos), dtype=dtype[i]) for i in range(len(fields))]
+        db = Dbptr(self.Ptr)
+        for i, recno in enumerate(recnos):
+            db.record = int(recno)
+            for column, value in zip(out, db.getv(*fields)):
+                column[i] = value
+        if len(out) == 1:
+            return out[0]
+        return tuple(out)
@@ -0,0 +1,229 @@
+#! /usr/bin/env python
+#
+# query.py
+#
+# obspy antelope query module
+#
+# Contains a chainable, lazily evaluated query builder for Antelope Datascope
+# views. Filters, joins and sorts are collected in Python and only run, as
+# one pipeline of dbsubset/dbjoin/dbsort calls, when the result is needed.
+#
+# This does NOT depend on ObsPy, only the Antelope API.
+
+import calendar
+import datetime
+import numbers
+import re
+from obspy_ext.antelope.utils import add_antelope_path
+add_antelope_path()
+from antelope.datascope import *  # all is necessary for db query variables
+
+_FIELD = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*(\.[A-Za-z_][A-Za-z0-9_]*)?$')
+
+
+def _field(name):
+    """Check a field name, so nothing else sneaks into an expression"""
+    if not _FIELD.match(name):
+        raise ValueError("Not a valid field name: '{0}'".format(name))
+    return name
+
+
+def quote(value):
+    """
+    Datascope expression literal of a value.
+
+    Strings are double quoted with quotes and backslashes escaped. Numbers,
+    including numpy scalars (e.g. from to_structured), and times (epoch
+    seconds of a UTCDateTime, or of a datetime taken as UTC) are written
+    out as plain ints or floats in full precision.
+    """
+    if isinstance(value, datetime.datetime):
+        value = calendar.timegm(value.utctimetuple()) + value.microsecond / 1e6
+    elif hasattr(value, 'timestamp') and not callable(value.timestamp):
+        value = value.timestamp
+    if isinstance(value, bool) or getattr(value, 'dtype', None) is not None \
+       and value.dtype.kind == 'b':
+        value = int(value)
+    if isinstance(value, numbers.Integral):
+        return repr(int(value))
+    if isinstance(value, numbers.Real):
+        return repr(float(value))
+    if isinstance(value, bytes) and not isinstance(value, str):
+        value = value.decode('ascii')
+    value = str(value)
+    return '"{0}"'.format(value.replace('\\', '\\\\').replace('"', '\\"'))
+
+
+def quote_regex(pattern):
+    """Datascope /regex/ literal of a pattern, with slashes escaped"""
+    return '/{0}/'.format(str(pattern).replace('/', '\\/'))
+
+
+class DbQuery(object):
+    """
+    Chainable, lazy view of a Datascope table.
+
+    Each method returns a new DbQuery with one more step. Nothing is run
+    until the query is iterated, measured or materialized; then the steps
+    are compiled into one Datascope pipeline, with consecutive filters
+    pushed down into a single dbsubset, and run once. Values are always
+    quoted/escaped, never pasted into expressions as-is.
+
+    .. rubric:: Example
+    >>> wf = AttribDbptr('/Volumes/colza_HD/dbs/land', table='wfdisc')
+    >>> q = wf.where(sta='TOL0').between(t0, t1, end='endtime').join('site').sort('time')
+    >>> print(q)
+    DbQuery(wfdisc | subset sta == "TOL0" && endtime > 1213315200.0 && time < 1213401600.0 | join site | sort time)
+    >>> for dbr in q:
+    ...     print dbr.sta, dbr.chan, dbr.lat, dbr.lon
+    >>> arr = q.to_structured(['sta', 'chan', 'time', 'lat', 'lon'])
+    """
+    def __init__(self, db, steps=(), source=None):
+        """
+        :type db: antelope.datascope.Dbptr
+        :param db: Open pointer to the table or view to start from
+        :type source: object
+        :param source: Owner of the open db to keep alive (e.g. the
+            AttribDbptr the query was started from)
+        """
+        self.Ptr = Dbptr(db)
+        self._steps = tuple(steps)
+        self._source = source
+        self._result = None
+
+    def _add(self, *step):
+        return self.__class__(self.Ptr, self._steps + (step,), self._source)
+
+    # Building steps
+    def where(self, expression=None, **fields):
+        """
+        Keep records where fields equal values (a list of values means any
+        of them), and/or a raw Datascope expression is true.
+        """
+        clauses = []
+        if expression:
+            clauses.append('({0})'.format(expression))
+        for name in sorted(fields):
+            value = fields[name]
+            if isinstance(value, (list, tuple, set)):
+                ors = ['{0} == {1}'.format(_field(name), quote(v)) for v in value]
+                clauses.append('({0})'.format(' || '.join(ors)))
+            else:
+                clauses.append('{0} == {1}'.format(_field(name), quote(value)))
+        if not clauses:
+            return self
+        return self._add('subset', ' && '.join(clauses))
+
+    def match(self, **fields):
+        """Keep records where fields match regular expressions"""
+        clauses = ['{0} =~ {1}'.format(_field(name), quote_regex(fields[name]))
+                   for name in sorted(fields) if fields[name] is not None]
+        if not clauses:
+            return self
+        return self._add('subset', ' && '.join(clauses))
+
+    def between(self, starttime=None, endtime=None, field='time', end=None):
+        """
+        Keep records in a time window.
+
+        With only 'field', records with starttime <= field < endtime. With
+        an 'end' field too (e.g. wfdisc time/endtime), records overlapping
+        the window: end > starttime && field < endtime.
+        """
+        clauses = []
+        if starttime is not None:
+            if end is None:
+                clauses.append('{0} >= {1}'.format(_field(field), quote(starttime)))
+            else:
+                clauses.append('{0} > {1}'.format(_field(end), quote(starttime)))
+        if endtime is not None:
+            clauses.append('{0} < {1}'.format(_field(field), quote(endtime)))
+        if not clauses:
+            return self
+        return self._add('subset', ' && '.join(clauses))
+
+    def join(self, table, outer=False):
+        """Join another table of the database"""
+        return self._add('join', table, outer)
+
+    def sort(self, *fields, **kwargs):
+        """Sort by fields, keywords 'unique' and 'reverse' as for dbsort"""
+        unique = kwargs.pop('unique', False)
+        reverse = kwargs.pop('reverse', False)
+        if kwargs:
+            raise TypeError("Unexpected keyword(s): {0}".format(', '.join(kwargs)))
+        return self._add('sort', tuple([_field(f) for f in fields]), unique, reverse)
+
+    # Compiling and running
+    def compile(self):
+        """
+        The pipeline to run: the steps with consecutive subsets merged.
+
+        :rtype: list
+        :return: ('subset', expression), ('join', table, outer) and
+            ('sort', fields, unique, reverse) steps
+        """
+        pipeline = []
+        for step in self._steps:
+            if step[0] == 'subset' and pipeline and pipeline[-1][0] == 'subset':
+                pipeline[-1] = ('subset', ' && '.join([pipeline[-1][1], step[1]]))
+            else:
+                pipeline.append(step)
+        return pipeline
+
+    def __repr__(self):
+        parts = [self.Ptr.query(dbTABLE_NAME)]
+        for step in self.compile():
+            if step[0] == 'subset':
+                parts.append('subset {0}'.format(step[1]))
+            elif step[0] == 'join':
+                parts.append('{0}join {1}'.format('outer ' if step[2] else '', step[1]))
+            else:
+                parts.append('sort {0}'.format(' '.join(step[1])))
+        return "{0}({1})".format(self.__class__.__name__, ' | '.join(parts))
+
+    def run(self):
+        """
+        Run the pipeline (once, the result is kept).
+
+        :rtype: antelope.datascope.Dbptr
+        :return: Pointer to the resulting view
+        """
+        if self._result is None:
+            db = Dbptr(self.Ptr)
+            for step in self.compile():
+                if step[0] == 'subset':
+                    db = dbsubset(db, step[1])
+                elif step[0] == 'join':
+                    db = dbjoin(db, dblookup(db, table=step[1]), outer=step[2])
+                else:
+                    db = dbsort(db, *step[1], unique=step[2], reverse=step[3])
+            self._result = db
+        return Dbptr(self._result)
+
+    # Materializing
+    def __len__(self):
+        return self.run().nrecs()
+
+    def __iter__(self):
+        """DbrecordPtr's of the resulting records"""
+        from obspy_ext.antelope.dbpointers import AttribDbptr
+        return iter(AttribDbptr(self.run()))
+
+    def view(self, cache=False):
+        """The result as an AttribDbptr"""
+        from obspy_ext.antelope.dbpointers import AttribDbptr
+        return AttribDbptr(self.run(), cache=cache)
+
+    def records(self, compact=False):
+        """The result loaded as a DbrecordList (or CompactDbrecordList)"""
+        from obspy_ext.antelope.dbobjects import DbrecordList, CompactDbrecordList
+        if compact:
+            return CompactDbrecordList(self.run())
+        return DbrecordList(self.run())
+
+    def to_structured(self, fields=None):
+        """The result loaded as a numpy structured array"""
+        from obspy_ext.antelope.schema import DbSchema
+        db = self.run()
+        return DbSchema(db).structured(db, fields)
@@ -0,0 +1,171 @@
+#! /usr/bin/env python
+#
+# schema.py
+#
+# obspy antelope database schema module
+#
+# Contains a class holding the schema information of an Antelope Datascope
+# table or view, so it can be queried once and shared by every record.
+#
+# This does NOT depend on ObsPy, only the Antelope API and numpy.
+
+import numpy
+from obspy_ext.antelope.utils import add_antelope_path
+add_antelope_path()
+from antelope.datascope import *  # all is necessary for db query variables
+
+# numpy dtypes of Datascope field types. Anything else (strings) is a fixed
+# width string of the field size.
+FIELD_DTYPES = {
+    dbREAL    : 'f8',
+    dbTIME    : 'f8',
+    dbINTEGER : 'i8',
+    dbYEARDAY : 'i8',
+    }
+
+
+class DbSchema(object):
+    """
+    Schema of a Datascope table or view, queried once from a pointer.
+
+    Holds the same metadata a Dbrecord used to query for itself, and knows
+    the names to pull every field of a record in one multi-field getv.
+
+    Attributes
+    ----------
+    Table      - string of the table (or view) name
+    PrimaryKey - tuple of strings of fields in primary key
+    fields     - tuple of fields IN FIELD NUMBERED ORDER
+    Fields     - sorted list of the fields
+    field_set  - frozenset of fields and names, for fast membership tests
+    tables     - tuple of the tables in the view
+    names      - names to getv each field by. Same as fields, except that
+                 a field name repeated in a multi-table view is qualified
+                 with its base table, e.g. 'arrival.lddate'
+
+    .. rubric:: Example
+    >>> db = dbopen('demo','r')
+    >>> db = db.lookup(table='arrival')
+    >>> schema = DbSchema(db)
+    >>> db.record = 0
+    >>> values = schema.getv(db)
+    """
+    def __init__(self, db):
+        """
+        Query the schema of the table or view a pointer references.
+
+        :type db: antelope.datascope.Dbptr
+        :param db: Open pointer to an Antelope database view or table
+        """
+        self.Table      = db.query(dbTABLE_NAME)
+        self.PrimaryKey = db.query(dbPRIMARY_KEY)
+        self.fields     = db.query(dbTABLE_FIELDS)
+        self.tables     = db.query(dbVIEW_TABLES)
+        self.names      = self._qualified_names(db)
+        self.Fields     = sorted(self.fields)
+        self.field_set  = frozenset(self.fields) | frozenset(self.names)
+
+    def _qualified_names(self, db):
+        """Qualify repeated field names of a view with their base table"""
+        if len(set(self.fields)) == len(self.fields) or \
+           db.query(dbVIEW_TABLE_COUNT) <= 1:
+            return tuple(self.fields)
+        # Tables of the view holding each field, in view order
+        owners = {}
+        for table in self.tables:
+            for field_name in dblookup(db, table=table).query(dbTABLE_FIELDS):
+                owners.setdefault(field_name, []).append(table)
+        names = []
+        seen = {}
+        for field_name in self.fields:
+            n = seen.get(field_name, 0)
+            seen[field_name] = n + 1
+            tables = owners.get(field_name, [])
+            if n and n < len(tables):
+                field_name = '.'.join([tables[n], field_name])
+            names.append(field_name)
+        return tuple(names)
+
+    def dtype(self, db, fields=None):
+        """
+        numpy dtype of a record of the table or view.
+
+        Times and reals are floats, integers and yeardays are ints, and
+        strings are fixed width strings of the field size in the schema.
+
+        :type fields: list
+        :param fields: Names of the fields to include (default: all, by
+            the same names as 'names')
+        :rtype: numpy.dtype
+        """
+        if fields is None:
+            fields = self.names
+        dtype = []
+        for name in fields:
+            dbf = dblookup(db, field=name)
+            ftype = dbf.query(dbFIELD_TYPE)
+            if ftype in FIELD_DTYPES:
+                code = FIELD_DTYPES[ftype]
+            else:
+                code = '{0}{1}'.format(numpy.dtype(str).char, dbf.query(dbFIELD_SIZE))
+            dtype.append((str(name), code))
+        return numpy.dtype(dtype)
+
+    def structured(self, db, fields=None):
+        """
+        Read every record of the view into a numpy structured array of
+        dtype(), with one getv per record (see core.to_structured).
+        """
+        if fields is None:
+            fields = self.names
+        fields = tuple(fields)
+        db = Dbptr(db)
+        out = numpy.empty(db.nrecs(), dtype=self.dtype(db, fields))
+        for db.record in range(db.nrecs()):
+            out[db.record] = tuple(db.getv(*fields))
+        return out
+
+    def getv(self, db):
+        """
+        Values of every field of the record a pointer references.
+
+        Pulls the whole row in one multi-field getv. If that fails, falls
+        back to one getv per field, giving None for any field which can't
+        be extracted (in some cases, a query will return a valid field name
+        but dbgetv can't get a value).
+        """
+        try:
+            return list(db.getv(*self.names))
+        except:
+            values = []
+            for name in self.names:
+                try:
+                    values.append(db.getv(name)[0])
+                except:
+                    values.append(None)
+            return values
+
+
+# Schemas of base tables, shared by everything pointing into them, keyed by
+# (database file name, table name), which stay the same when database
+# numbers are reused after a close. Views are not kept, as their names and
+# fields change.
+_schemas = {}
+
+def get_schema(db):
+    """
+    DbSchema of the table or view a pointer references, shared per table.
+
+    Base tables are only queried once per database, views are queried
+    every call (hold on to the result).
+    """
+    if db.query(dbTABLE_IS_VIEW):
+        return DbSchema(db)
+    key = (db.query(dbDATABASE_FILENAME), db.query(dbTABLE_NAME))
+    if key not in _schemas:
+        _schemas[key] = DbSchema(db)
+    return _schemas[key]
+
+def clear_schemas():
+    """Forget shared schemas (e.g. after changing a database's schema)"""
+    _schemas.clear()
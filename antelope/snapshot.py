@@ -0,0 +1,236 @@
+#! /usr/bin/env python
+#
+# snapshot.py
+#
+# obspy antelope snapshot module
+#
+# Contains a persistent, columnar on-disk cache of Antelope Datascope tables
+# and views. A table (or view) is read once and saved as one .npy file per
+# field next to the database, then loaded (memory-mapped) from there as long
+# as the table files it came from haven't changed.
+#
+# Reading snapshots does NOT depend on Antelope, only numpy. Taking them
+# does.
+
+import json
+import os
+import shutil
+import tempfile
+import numpy
+from obspy_ext.antelope.utils import add_antelope_path
+from obspy_ext.antelope.wfdisc import file_stamp
+
+META = 'snapshot.json'
+GENERATION = 'columns.'
+
+
+class Snapshot(object):
+    """
+    A snapshot of a table or view: memory-mapped .npy columns in a directory.
+
+    Columns are mapped on first access. A snapshot is current as long as
+    the stamps (mtime, size) of the table files it was made from match.
+
+    .. rubric:: Example
+    >>> snap = Snapshot('/opt/antelope/data/db/demo/demo.snapshots/origin')
+    >>> snap.is_current()
+    True
+    >>> snap['depth'].max()
+    213.9
+    """
+    def __init__(self, directory):
+        """
+        :type directory: str
+        :param directory: Directory the snapshot was saved to
+        """
+        self.directory = directory
+        with open(os.path.join(directory, META)) as fh:
+            meta = json.load(fh)
+        self.Table = meta['table']
+        self.fields = tuple(meta['fields'])
+        self.nrecs = meta['nrecs']
+        self.definition = meta.get('definition')
+        self.stamps = dict([(f, tuple(s) if s else None)
+                            for f, s in meta['stamps'].items()])
+        # Columns of this generation, mapped now so a newer save (which
+        # removes old generations) can't pull them from under us
+        self.columns_dir = os.path.join(directory, meta.get('columns', ''))
+        self._columns = {}
+        for field in self.fields:
+            fname = os.path.join(self.columns_dir, field + '.npy')
+            self._columns[field] = numpy.load(fname, mmap_mode='r')
+
+    def __len__(self):
+        return self.nrecs
+
+    def __repr__(self):
+        return "{0}('{1}' -> {2} records)".format(self.__class__.__name__,
+                                                  self.directory, len(self))
+
+    def __getitem__(self, field):
+        """Memory-mapped column of a field"""
+        if field not in self.fields:
+            raise KeyError(field)
+        return self._columns[field]
+
+    def is_current(self):
+        """True if none of the table files changed since the snapshot"""
+        return self.stamps == table_stamps(self.stamps)
+
+    def to_structured(self, fields=None):
+        """The snapshot (or some fields of it) as a structured array"""
+        if fields is None:
+            fields = self.fields
+        columns = [self[field] for field in fields]
+        dtype = numpy.dtype([(str(f), c.dtype) for f, c in zip(fields, columns)])
+        out = numpy.empty(len(self), dtype=dtype)
+        for field, column in zip(fields, columns):
+            out[field] = column
+        return out
+
+    def rows(self):
+        """Python values of every field, one tuple per record"""
+        return zip(*[self[field].tolist() for field in self.fields])
+
+    @classmethod
+    def save(cls, directory, table, data, stamps, definition=None):
+        """
+        Save a structured array as a snapshot.
+
+        The columns go into a new generation directory, never over the
+        files of an existing snapshot (which may be mapped by a reader),
+        and the metadata pointing at them is then renamed into place. So a
+        half-written snapshot is never picked up, and a loaded one keeps
+        its data. Generations older than the previous one are removed.
+
+        :type directory: str
+        :param directory: Directory to save to, made if needed
+        :type table: str
+        :param table: Name of the table or view
+        :type data: numpy.ndarray
+        :param data: Structured array of the records
+        :type stamps: dict
+        :param stamps: Table file name -> file stamp, taken BEFORE reading
+        :type definition: str
+        :param definition: How the view was made (e.g. a DbQuery repr)
+        :rtype: Snapshot
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        previous = None
+        try:
+            with open(os.path.join(directory, META)) as fh:
+                previous = json.load(fh).get('columns')
+        except (IOError, OSError, ValueError):
+            pass
+        # mkdtemp/mkstemp make private (0700/0600) entries: give them the
+        # usual modes, so other users of the database can read snapshots
+        umask = _umask()
+        columns = tempfile.mkdtemp(prefix=GENERATION, dir=directory)
+        os.chmod(columns, 0o777 & ~umask)
+        for field in data.dtype.names:
+            numpy.save(os.path.join(columns, field + '.npy'), data[field])
+        meta = {'table': table, 'fields': list(data.dtype.names),
+                'nrecs': len(data), 'stamps': stamps, 'definition': definition,
+                'columns': os.path.basename(columns)}
+        fd, tmp = tempfile.mkstemp(prefix=META + '.', suffix='.tmp',
+                                   dir=directory)
+        with os.fdopen(fd, 'w') as fh:
+            os.fchmod(fh.fileno(), 0o666 & ~umask)
+            json.dump(meta, fh)
+        os.rename(tmp, os.path.join(directory, META))
+        keep = set([os.path.basename(columns), previous])
+        for name in os.listdir(directory):
+            if name.startswith(GENERATION) and name not in keep:
+                shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+        return cls(directory)
+
+
+def _umask():
+    """Current umask (read by setting it and putting it back)"""
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+def table_stamps(fnames):
+    """File stamp of each table file, None for tables with no file"""
+    stamps = {}
+    for fname in fnames:
+        try:
+            stamps[fname] = file_stamp(fname)
+        except OSError:
+            stamps[fname] = None
+    return stamps
+
+
+def snapshot_dir(db, name):
+    """Directory of a snapshot: DATABASE.snapshots/NAME"""
+    add_antelope_path()
+    from antelope.datascope import dbDATABASE_FILENAME
+    return os.path.join(db.query(dbDATABASE_FILENAME) + '.snapshots', name)
+
+
+def take_snapshot(db, name=None, refresh=False):
+    """
+    Current Snapshot of a table or view, taking a new one if needed.
+
+    If there's no snapshot under this name, or any of the table files of
+    the view changed since it was taken, or the view doesn't have the same
+    fields, number of records or definition, the view is read (see
+    DbSchema.structured) and saved again. Otherwise the existing one is
+    returned, without touching the db beyond a few queries.
+
+    A Dbptr to a view doesn't say how the view was made, so for a view
+    given as a Dbptr only its fields and number of records are checked,
+    and a different subset of the same size under the same name would
+    give the old rows. Give the view as a DbQuery, whose steps are saved
+    and compared as its definition, or give each view its own name.
+
+    :type db: antelope.datascope.Dbptr or DbQuery
+    :param db: Open pointer to an Antelope database view or table, or a
+        query of one
+    :type name: str
+    :param name: Snapshot name. Defaults to the table name, but MUST be
+        given for views, which have no stable names.
+    :type refresh: bool
+    :param refresh: Take a new snapshot even if the old one is current
+    :rtype: Snapshot
+
+    .. rubric:: Example
+    >>> db = dbopen('/opt/antelope/data/db/demo/demo', 'r')
+    >>> origin = take_snapshot(db.lookup(table='origin'))
+    >>> view = db.lookup(table='origin').join('assoc').join('arrival')
+    >>> picks = take_snapshot(view, name='origin_assoc_arrival')
+    >>> q = DbQuery(db.lookup(table='origin')).where(auth='ANF').join('assoc')
+    >>> anf = take_snapshot(q, name='anf_assoc')
+    """
+    add_antelope_path()
+    from antelope.datascope import (dblookup, dbTABLE_FILENAME,
+                                    dbTABLE_IS_VIEW)
+    from obspy_ext.antelope.schema import DbSchema
+    from obspy_ext.antelope.query import DbQuery
+    definition = None
+    if isinstance(db, DbQuery):
+        definition = repr(db)
+        db = db.run()
+    schema = DbSchema(db)
+    if name is None:
+        if db.query(dbTABLE_IS_VIEW):
+            raise ValueError("Give a snapshot name for views")
+        name = schema.Table
+    tables = schema.tables or (schema.Table,)
+    fnames = [dblookup(db, table=t).query(dbTABLE_FILENAME) for t in tables]
+    stamps = table_stamps(fnames)
+    directory = snapshot_dir(db, name)
+    if not refresh and os.path.exists(os.path.join(directory, META)):
+        try:
+            snap = Snapshot(directory)
+        except (IOError, OSError, ValueError, KeyError):
+            snap = None
+        if snap is not None and snap.stamps == stamps and \
+           snap.fields == tuple(schema.names) and \
+           snap.nrecs == db.nrecs() and snap.definition == definition:
+            return snap
+    data = schema.structured(db)
+    return Snapshot.save(directory, schema.Table, data, stamps, definition)
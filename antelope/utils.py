@@ -4,8 +4,21 @@
 """
 obspy antelope module utilities
 """
-import sys, os
+import sys, os, time, threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+_antelope_path = None
+
 def add_antelope_path():
+	"""
+	Add the Antelope python directory to sys.path, once.
+
+	Returns the directory. Later calls just return it again.
+	"""
+	global _antelope_path
+	if _antelope_path is not None:
+		return _antelope_path
 	_version_string = os.environ['ANTELOPE'].split('/')[-1]
 	_pydirs = ['data','python']
 	if float(_version_string[:3]) < 5.2:
@@ -13,24 +26,134 @@ def add_antelope_path():
 	_pypath = os.path.join(os.environ['ANTELOPE'], *_pydirs)
 	if _pypath not in sys.path:
 		sys.path.append(_pypath)
+	_antelope_path = _pypath
+	return _pypath
+
+
+def _datascope():
+	"""The antelope.datascope module, imported on first use"""
+	add_antelope_path()
+	from antelope import datascope
+	return datascope
+
+class DbPool(object):
+	"""
+	Process-wide pool of open databases, keyed by (path, permission).
+
+	acquire() reuses an open database if there is one, and counts
+	references to it. release() gives a reference back. Databases with no
+	references stay open until close_all() is called.
+
+	Datascope gives the same database # to every dbopen of a descriptor,
+	so the pool can't tell a handle only it uses from one the caller also
+	opened with dbopen, and closing it would break the caller's pointer.
+	So closing idle databases automatically is opt-in: with 'timeout' set,
+	ones idle for that many seconds are closed, and with 'maxsize' set,
+	least recently used ones are closed when more than that are open. Only
+	set these when nothing else opens the same descriptors.
+
+	.. rubric:: Example
+	>>> with dbpool.open('/opt/antelope/data/db/demo/demo') as db:
+	...     db = db.lookup(table='site')
+	...     print db.nrecs()
+	13
+	"""
+	def __init__(self, maxsize=None, timeout=None):
+		self.maxsize = maxsize
+		self.timeout = timeout
+		self._handles = OrderedDict() # key -> [Dbptr, refs, last used]
+		self._keys = {}               # database # -> key
+		self._lock = threading.RLock()
+		self.on_close = []            # called with the database # on close
+
+	def __len__(self):
+		return len(self._handles)
 
+	def __repr__(self):
+		return "{0}({1} open, {2} in use)".format(self.__class__.__name__,
+			len(self), len([e for e in self._handles.values() if e[1]]))
+
+	def acquire(self, path, perm='r'):
+		"""Pointer to an open database, opening it only if needed"""
+		ds = _datascope()
+		key = (os.path.abspath(path), perm)
+		with self._lock:
+			if key in self._handles:
+				entry = self._handles.pop(key)
+			else:
+				entry = [ds.dbopen(path, perm), 0, 0.]
+				self._keys[entry[0].database] = key
+			self._handles[key] = entry   # most recently used goes last
+			entry[1] += 1
+			entry[2] = time.time()
+			self.prune()
+			return ds.Dbptr(entry[0])
+
+	def release(self, db):
+		"""Give back a reference to a database gotten from acquire()"""
+		with self._lock:
+			key = self._keys.get(db.database)
+			if key in self._handles:
+				entry = self._handles[key]
+				entry[1] = max(0, entry[1] - 1)
+				entry[2] = time.time()
+			self.prune()
+
+	def prune(self):
+		"""Close databases idle for too long, or over the size limit, if set"""
+		if self.timeout is None and self.maxsize is None:
+			return
+		with self._lock:
+			now = time.time()
+			idle = [k for k, e in self._handles.items() if not e[1]]
+			for key in idle:
+				if self.timeout is not None and \
+				   now - self._handles[key][2] > self.timeout or \
+				   self.maxsize is not None and \
+				   len(self._handles) > self.maxsize:
+					self._close(key)
+
+	def close_all(self):
+		"""Close every database with no references left"""
+		with self._lock:
+			for key in [k for k, e in self._handles.items() if not e[1]]:
+				self._close(key)
+
+	def _close(self, key):
+		db = self._handles.pop(key)[0]
+		self._keys.pop(db.database, None)
+		for callback in self.on_close:
+			callback(db.database)
+		db.close()
+
+	@contextmanager
+	def open(self, path, perm='r'):
+		"""Context manager version of acquire/release"""
+		db = self.acquire(path, perm)
+		try:
+			yield db
+		finally:
+			self.release(db)
+
+# The pool used by everything in this module
+dbpool = DbPool()
 
-add_antelope_path()
-from antelope.datascope import Dbptr, dbopen
 
 def open_db_or_string(database, perm='r'):
 	'''
 	Check if a variable is a valid db or a string
 
-	Returns a pointer to an open db or throw an error
+	Returns a pointer to an open db or throw an error, and True if the db
+	was opened from a string. Opened dbs come from the shared pool, give
+	them back with dbpool.release(ptr) when done.
 	'''
-	if isinstance(database, Dbptr):
-		ptr = Dbptr(database)
+	ds = _datascope()
+	opened = False
+	if isinstance(database, ds.Dbptr):
+		ptr = ds.Dbptr(database)
 	elif isinstance(database, str):
-		ptr = dbopen(database, perm)
+		ptr = dbpool.acquire(database, perm)
 		opened = True
 	else:
 		raise TypeError("Input must be a Dbptr or string of a valid database path")
 	return ptr, opened
-
-
@@ -0,0 +1,392 @@
+#! /usr/bin/env python
+#
+# wfdisc.py
+#
+# obspy antelope wfdisc module
+#
+# Contains helpers to work directly with the waveform files referenced by
+# an Antelope Datascope 'wfdisc' table.
+#
+# These do NOT depend on ObsPy or Antelope, only numpy, so they can be used
+# on the values of a wfdisc row from anywhere.
+
+import math
+import os
+import re
+import threading
+from collections import OrderedDict
+import numpy
+from obspy_ext.antelope.flatfile import FlatTable
+
+# Raw Datascope/CSS datatypes which are just a block of binary samples,
+# mapped to numpy dtypes (same conventions as ObsPy's CSS reader).
+DTYPES = {
+    # Big-endian integers
+    's4': '>i4',
+    's2': '>i2',
+    # Little-endian integers
+    'i4': '<i4',
+    'i2': '<i2',
+    # Big-endian floating point
+    't4': '>f4',
+    't8': '>f8',
+    # Little-endian floating point
+    'f4': '<f4',
+    'f8': '<f8',
+    }
+
+# Decimals of a sample offsets are rounded to before taking whole samples
+SAMPLE_TOLERANCE = 3
+
+
+def sample_range(time, samprate, nsamp, starttime=None, endtime=None):
+    """
+    Index range of the samples of a segment falling inside a time window.
+
+    Samples exactly on either window edge are included, as in Trace.slice.
+    "Exactly" is to SAMPLE_TOLERANCE decimals of a sample, as epoch floats
+    only resolve ~0.2 microseconds, a few 1e-5 samples at high rates.
+
+    :type time: float
+    :param time: Epoch time of the first sample of the segment
+    :type samprate: float
+    :param samprate: Sampling rate of the segment, in Hz
+    :type nsamp: int
+    :param nsamp: Number of samples in the segment
+    :type starttime: float
+    :param starttime: Epoch start of the window (default: start of segment)
+    :type endtime: float
+    :param endtime: Epoch end of the window (default: end of segment)
+    :rtype: tuple
+    :return: (first, last) sample indices, python slice style
+    """
+    first = 0
+    last = int(nsamp)
+    if starttime is not None:
+        offset = round((starttime - time) * samprate, SAMPLE_TOLERANCE)
+        first = max(first, int(math.ceil(offset)))
+    if endtime is not None:
+        offset = round((endtime - time) * samprate, SAMPLE_TOLERANCE)
+        last = min(last, int(math.floor(offset)) + 1)
+    return first, max(first, last)
+
+
+def chunk_range(time, samprate, nsamp, c0, c1):
+    """
+    Index range of the samples of a segment falling in the chunk [c0, c1).
+
+    A chunk holds the samples from the first one at or after c0 up to, but
+    not including, the first one at or after c1 (both as in sample_range),
+    so consecutive chunks share their boundary and every sample lands in
+    exactly one of them, wherever the chunk grid falls on the sample grid.
+
+    :rtype: tuple
+    :return: (first, last) sample indices, python slice style
+    """
+    first = min(sample_range(time, samprate, nsamp, starttime=c0)[0], nsamp)
+    last = min(sample_range(time, samprate, nsamp, starttime=c1)[0], nsamp)
+    return first, max(first, last)
+
+
+def read_raw(fname, datatype, foff, first, last, out=None):
+    """
+    Read samples [first, last) of a raw wfdisc segment from a file.
+
+    The file is memory-mapped starting at 'foff' plus the sample offset, so
+    only the requested samples are ever touched, and they are copied once
+    into a native byte order array (or straight into 'out').
+
+    :type fname: str
+    :param fname: Name of the waveform file (wfdisc dir/dfile)
+    :type datatype: str
+    :param datatype: wfdisc datatype code, one of the keys of DTYPES
+    :type foff: int
+    :param foff: Byte offset of the segment in the file (wfdisc foff)
+    :type first: int
+    :param first: Index of first sample to read
+    :type last: int
+    :param last: Index one past the last sample to read
+    :type out: numpy.ndarray
+    :param out: Array of last - first samples to decode into (converted
+        to its dtype), instead of a new one
+    :rtype: numpy.ndarray
+    :return: Samples in native byte order, or 'out'
+    """
+    if datatype not in DTYPES:
+        raise ValueError("Can't decode datatype '{0}' directly".format(datatype))
+    dtype = numpy.dtype(DTYPES[datatype])
+    native = dtype.newbyteorder('=')
+    if last <= first:
+        if out is not None:
+            return out
+        return numpy.empty(0, dtype=native)
+    mm = numpy.memmap(fname, dtype=dtype, mode='r',
+                      offset=int(foff) + first * dtype.itemsize,
+                      shape=(last - first,))
+    if out is not None:
+        out[...] = mm
+        data = out
+    else:
+        data = numpy.array(mm, dtype=native)
+    del mm
+    return data
+
+
+def file_stamp(fname):
+    """(mtime, size) of a file, used to tell when a derived file is stale"""
+    st = os.stat(fname)
+    return (float(st.st_mtime), float(st.st_size))
+
+
+class WfdiscIndex(object):
+    """
+    In-memory interval index over the rows of a wfdisc table.
+
+    Holds, for every (sta, chan), the rows sorted by start time, along with
+    a running maximum of their end times, so a window query is two
+    bisections instead of a scan of the whole table. Queries return
+    record numbers into the table the index was built from.
+
+    .. rubric:: Example
+
+    >>> index = WfdiscIndex(sta, chan, time, endtime)
+    >>> index.query('TOL0', 'LH.', UTCDateTime(2008,6,13), UTCDateTime(2008,6,14))
+    array([10234, 10235, 10236, 10611, 10612, 10613])
+    """
+    def __init__(self, sta, chan, time, endtime, record=None, stamp=None):
+        """
+        Build the index from columns of the table.
+
+        :type sta, chan, time, endtime: array-like
+        :param sta, chan, time, endtime: wfdisc columns, one entry per row
+        :type record: array-like
+        :param record: Record numbers of the rows (default: 0..N-1)
+        :type stamp: tuple
+        :param stamp: file_stamp() of the table file the rows came from
+        """
+        self.sta = numpy.asarray(sta)
+        self.chan = numpy.asarray(chan)
+        self.time = numpy.asarray(time, dtype=float)
+        self.endtime = numpy.asarray(endtime, dtype=float)
+        if record is None:
+            record = numpy.arange(len(self.time))
+        self.record = numpy.asarray(record, dtype=int)
+        self.stamp = stamp
+        self._channels = {}
+        if not len(self.time):
+            return
+        order = numpy.lexsort((self.time, self.chan, self.sta))
+        sta = self.sta[order]
+        chan = self.chan[order]
+        breaks = numpy.flatnonzero((sta[1:] != sta[:-1]) | (chan[1:] != chan[:-1])) + 1
+        for rows in numpy.split(order, breaks):
+            endtime = self.endtime[rows]
+            self._channels[(self.sta[rows[0]], self.chan[rows[0]])] = (
+                self.time[rows], endtime, numpy.maximum.accumulate(endtime),
+                self.record[rows])
+
+    @classmethod
+    def from_flatfile(cls, database, schema=None):
+        """
+        Build the index straight from a database's wfdisc file, without
+        Antelope (see flatfile.FlatTable).
+        """
+        table = FlatTable(database, 'wfdisc', schema)
+        columns = table.columns('sta', 'chan', 'time', 'endtime')
+        return cls(columns['sta'], columns['chan'], columns['time'],
+                   columns['endtime'], stamp=file_stamp(table.filename))
+
+    def __len__(self):
+        return len(self.record)
+
+    @property
+    def channels(self):
+        """Sorted list of (sta, chan) in the index"""
+        return sorted(self._channels)
+
+    def _keys(self, station=None, channel=None):
+        """(sta, chan) keys matching Datascope style regex expressions"""
+        keys = self._channels.keys()
+        if station is not None:
+            match = re.compile('(?:{0})$'.format(station)).match
+            keys = [k for k in keys if match(k[0])]
+        if channel is not None:
+            match = re.compile('(?:{0})$'.format(channel)).match
+            keys = [k for k in keys if match(k[1])]
+        return keys
+
+    def query(self, station=None, channel=None, starttime=None, endtime=None):
+        """
+        Record numbers of rows overlapping a time window.
+
+        Same matching as the readANTELOPE subsets: station and channel are
+        regular expressions, and a row matches if endtime > starttime and
+        time < endtime.
+
+        :rtype: numpy.ndarray
+        :return: Sorted record numbers
+        """
+        hits = []
+        for key in self._keys(station, channel):
+            time, etime, maxend, record = self._channels[key]
+            first, last = 0, len(time)
+            if endtime is not None:
+                last = numpy.searchsorted(time, float(endtime), side='left')
+            if starttime is not None:
+                first = numpy.searchsorted(maxend, float(starttime), side='right')
+                keep = etime[first:last] > float(starttime)
+                hits.append(record[first:last][keep])
+            else:
+                hits.append(record[first:last])
+        if not hits:
+            return numpy.empty(0, dtype=int)
+        return numpy.sort(numpy.concatenate(hits))
+
+    def save(self, fname):
+        """Save the index to a .npz sidecar file"""
+        stamp = self.stamp or ()
+        with open(fname, 'wb') as fh:
+            numpy.savez(fh, sta=self.sta, chan=self.chan, time=self.time,
+                        endtime=self.endtime, record=self.record,
+                        stamp=numpy.array(stamp, dtype=float))
+
+    @classmethod
+    def load(cls, fname):
+        """Load an index saved with save()"""
+        with open(fname, 'rb') as fh:
+            npz = numpy.load(fh)
+            stamp = tuple([float(x) for x in npz['stamp']]) or None
+            return cls(npz['sta'], npz['chan'], npz['time'], npz['endtime'],
+                       record=npz['record'], stamp=stamp)
+
+
+class WaveformCache(object):
+    """
+    LRU cache of decoded raw wfdisc samples, with a memory budget.
+
+    Decoded samples are kept in fixed-size blocks of 'block_size' samples,
+    keyed by (file, foff, datatype) and block number. A read is served from
+    the blocks it spans, only reading missing (or too short) blocks from the
+    file, so sliding or overlapping windows reuse what is cached without
+    ever re-copying it. Least recently used blocks are dropped once the
+    cache holds more than 'maxbytes', and everything from a file is dropped
+    when its mtime or size changes.
+
+    Pass one to readANTELOPE & co as 'cache' to use it. Safe to share
+    between threads, but each process has its own.
+
+    .. rubric:: Example
+
+    >>> cache = WaveformCache(maxbytes=512 * 1024**2)
+    >>> st = readANTELOPE(db, station='TOL0', starttime=t0, endtime=t1, cache=cache)
+    >>> cache.hits, cache.misses, cache.evictions
+    (0, 3, 0)
+    """
+    def __init__(self, maxbytes=256 * 1024**2, block_size=65536):
+        """
+        :type maxbytes: int
+        :param maxbytes: Budget for the cached samples, in bytes
+        :type block_size: int
+        :param block_size: Number of samples in a block
+        """
+        self.maxbytes = maxbytes
+        self.block_size = int(block_size)
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._blocks = OrderedDict()  # (segment, block #) -> data
+        self._stamps = {}             # file name -> file_stamp
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._blocks)
+
+    def __repr__(self):
+        return "{0}({1} blocks, {2}/{3} bytes, {4} hits, {5} misses, {6} evictions)".format(
+            self.__class__.__name__, len(self), self.nbytes, self.maxbytes,
+            self.hits, self.misses, self.evictions)
+
+    def clear(self):
+        """Drop everything and reset the counters"""
+        with self._lock:
+            self._blocks.clear()
+            self._stamps.clear()
+            self.nbytes = self.hits = self.misses = self.evictions = 0
+
+    def invalidate(self, fname):
+        """Drop every cached block read from a file"""
+        with self._lock:
+            for key in [k for k in self._blocks if k[0][0] == fname]:
+                self._drop(key)
+            self._stamps.pop(fname, None)
+
+    def _drop(self, key):
+        data = self._blocks.pop(key)
+        self.nbytes -= data.nbytes
+
+    def _check(self, fname):
+        """Invalidate a file if it changed since it was cached"""
+        stamp = file_stamp(fname)
+        if self._stamps.get(fname) != stamp:
+            self.invalidate(fname)
+            self._stamps[fname] = stamp
+
+    def _store(self, key, data):
+        """Add a block, evicting least recently used ones to stay in budget"""
+        if key in self._blocks:
+            self._drop(key)
+        if data.nbytes > self.maxbytes:
+            self.evictions += 1
+            return
+        self._blocks[key] = data
+        self.nbytes += data.nbytes
+        while self.nbytes > self.maxbytes:
+            self._drop(next(iter(self._blocks)))
+            self.evictions += 1
+
+    def read(self, fname, datatype, foff, first, last):
+        """
+        Same as read_raw, but served from and stored in the cache.
+
+        Returns a new array, so changing the samples doesn't change the cache.
+        """
+        if last <= first:
+            return read_raw(fname, datatype, foff, first, last)
+        segment = (fname, int(foff), datatype)
+        size = self.block_size
+        blocks = range(first // size, (last - 1) // size + 1)
+        cached = {}
+        with self._lock:
+            self._check(fname)
+            for b in blocks:
+                data = self._blocks.pop((segment, b), None)
+                if data is not None:
+                    # Most recently used goes last
+                    self._blocks[(segment, b)] = data
+                    cached[b] = data
+        out = None
+        fresh = False
+        for b in blocks:
+            b0 = b * size
+            need = min(last, b0 + size) - b0
+            data = cached.get(b)
+            if data is None or len(data) < need:
+                # A block always starts at its first sample, and never goes
+                # past the last sample ever asked for, so it stays in the
+                # segment
+                n = max(need, 0 if data is None else len(data))
+                data = read_raw(fname, datatype, foff, b0, b0 + n)
+                fresh = True
+                with self._lock:
+                    self._store((segment, b), data)
+            if out is None:
+                out = numpy.empty(last - first, dtype=data.dtype)
+            lo = max(first, b0)
+            out[lo - first:b0 + need - first] = data[lo - b0:need]
+        with self._lock:
+            if fresh:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return out
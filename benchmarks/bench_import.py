@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+#
+# Import-time benchmark for the obspy_ext packages
+#
+# Times, in fresh interpreters, a bare import of each package against the
+# old eager behaviour (every public name loaded, i.e. all submodules plus
+# Antelope/ObsPy). The difference is what short-lived tools and worker
+# processes save by only using part of a package.
+#
+# Use: python benchmarks/bench_import.py [repeats]
+#      (obspy_ext must be importable, e.g. on PYTHONPATH)
+#
+import subprocess
+import sys
+import time
+
+CASES = [
+    ('antelope, lazy',  "import obspy_ext.antelope"),
+    ('antelope, flatfile only',
+     "from obspy_ext.antelope import FlatTable"),
+    ('antelope, eager', "import obspy_ext.antelope as m; [getattr(m, n) for n in m.__all__]"),
+    ('anss, lazy',      "import obspy_ext.anss"),
+    ('anss, eager',     "import obspy_ext.anss as m; [getattr(m, n) for n in m.__all__]"),
+    ]
+
+
+def time_statement(statement, repeats):
+    """Best wall time of running a statement in a fresh interpreter"""
+    best = None
+    for n in range(repeats):
+        t0 = time.time()
+        status = subprocess.call([sys.executable, '-c', statement])
+        elapsed = time.time() - t0
+        if status:
+            return None
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main(repeats=5):
+    baseline = time_statement('pass', repeats)
+    print("{0:<28} {1:>10}".format('case', 'ms'))
+    for name, statement in CASES:
+        elapsed = time_statement(statement, repeats)
+        if elapsed is None:
+            print("{0:<28} {1:>10}".format(name, 'failed'))
+        else:
+            print("{0:<28} {1:>10.1f}".format(name, 1000 * (elapsed - baseline)))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+#
+#
+"""
+Lazy attribute loading for the obspy_ext packages
+
+Importing a package which uses this only imports the package itself. The
+submodule holding a name (and its heavy dependencies, e.g. the Antelope
+libraries or ObsPy) is imported the first time the name is used.
+"""
+import sys
+import types
+from importlib import import_module
+
+
+class LazyModule(types.ModuleType):
+    """
+    Module which imports its public names from submodules on first access.
+    """
+    def __init__(self, name, exports, doc=None):
+        """
+        :type name: str
+        :param name: Full name of the package, i.e. __name__
+        :type exports: dict
+        :param exports: Public name -> name of the submodule defining it
+        """
+        super(LazyModule, self).__init__(name, doc)
+        self._exports = exports
+        self.__all__ = sorted(exports)
+
+    def __getattr__(self, name):
+        exports = self.__dict__.get('_exports', {})
+        if name not in exports:
+            raise AttributeError("module '{0}' has no attribute '{1}'".format(
+                self.__name__, name))
+        module = import_module('.'.join([self.__name__, exports[name]]))
+        value = getattr(module, name)
+        setattr(self, name, value)
+        return value
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(self._exports))
+
+
+def lazy_package(name, exports):
+    """
+    Replace an (already importing) package in sys.modules with a LazyModule.
+
+    Call at the bottom of the package __init__ as
+    lazy_package(__name__, {'name': 'submodule', ...})
+    """
+    package = sys.modules[name]
+    module = LazyModule(name, exports, package.__doc__)
+    for attr in ('__file__', '__path__', '__package__', '__loader__', '__spec__'):
+        if hasattr(package, attr):
+            setattr(module, attr, getattr(package, attr))
+    # Keep the original alive, python 2 clears module globals on deletion
+    module._package = package
+    sys.modules[name] = module
+    return module
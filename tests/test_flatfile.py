@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+#
+# Tests of the flat-file table reader, which only needs numpy (no Antelope
+# or ObsPy)
+#
+# Use: python -m unittest discover tests
+#      (obspy_ext must be importable, e.g. on PYTHONPATH)
+#
+import os
+import shutil
+import tempfile
+import unittest
+from obspy_ext.antelope.flatfile import FlatSchema, FlatTable
+
+SCHEMA = """
+Schema test1.0
+    Description ( "Test schema" ) ;
+
+Attribute sta
+    String (6)
+    Null ( "-" ) ;
+
+Attribute ondate
+    Yearday (8)
+    Null ( "-1" ) ;
+
+Attribute lat
+    Real (9)
+    Format ( "%9.4lf" )
+    Null ( "-999.0000" ) ;
+
+Relation site
+    Fields ( sta ondate lat )
+    Primary ( sta ondate ) ;
+"""
+
+ROWS = ['{0:<6} {1:>8} {2:>9.4f}\n'.format(*row)
+        for row in [('TOL0', 2008001, 44.5), ('TOL1', 2008002, -12.25)]]
+
+
+class FlatTableTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        with open(os.path.join(self.dir, 'test1.0'), 'w') as fh:
+            fh.write(SCHEMA)
+        self.schema = FlatSchema(os.path.join(self.dir, 'test1.0'))
+        os.mkdir(os.path.join(self.dir, 'master'))
+        with open(os.path.join(self.dir, 'master', 'dbmaster.site'), 'w') as fh:
+            fh.writelines(ROWS)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _descriptor(self, name, *lines):
+        fname = os.path.join(self.dir, name)
+        with open(fname, 'w') as fh:
+            fh.write('\n'.join(('#',) + lines) + '\n')
+        return fname
+
+    def test_table_next_to_descriptor(self):
+        db = self._descriptor('local', 'schema test1.0')
+        with open(db + '.site', 'w') as fh:
+            fh.writelines(ROWS[:1])
+        site = FlatTable(db, 'site', self.schema)
+        self.assertEqual(site.filename, db + '.site')
+        self.assertEqual(list(site['sta']), ['TOL0'])
+
+    def test_table_on_dbpath(self):
+        db = self._descriptor('land', 'schema test1.0',
+                              'dbpath ./{land}:master/{dbmaster}')
+        site = FlatTable(db, 'site', self.schema)
+        self.assertEqual(site.filename,
+                         os.path.join(self.dir, 'master', 'dbmaster.site'))
+        self.assertEqual(len(site), 2)
+        self.assertEqual(list(site['lat']), [44.5, -12.25])
+        # The first database on the path with the table wins
+        with open(db + '.site', 'w') as fh:
+            fh.writelines(ROWS[1:])
+        site = FlatTable(db, 'site', self.schema)
+        self.assertEqual(list(site['sta']), ['TOL1'])
+
+    def test_empty_and_missing_tables(self):
+        db = self._descriptor('empty', 'schema test1.0')
+        self.assertRaises(IOError, FlatTable, db, 'site', self.schema)
+        open(db + '.site', 'w').close()
+        site = FlatTable(db, 'site', self.schema)
+        self.assertEqual(len(site), 0)
+        self.assertEqual(len(site['sta']), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
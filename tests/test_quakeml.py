@@ -0,0 +1,247 @@
+#!/usr/bin/env python
+#
+# Tests of the ANSS QuakeML writers and reader, which only need ObsPy (no
+# Antelope)
+#
+# Use: python -m unittest discover tests
+#      (obspy_ext must be importable, e.g. on PYTHONPATH)
+#
+import io
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+from obspy.core import UTCDateTime
+from obspy.core.event import (Catalog, Event, Origin, Magnitude, Pick,
+    WaveformStreamID, FocalMechanism, NodalPlanes, NodalPlane,
+    ResourceIdentifier)
+from obspy_ext.anss.quakeml import (NamespacePickler, FragmentCache,
+    writeNamespaceQuakeML, streamNamespaceQuakeML, iterNamespaceQuakeML,
+    writeNamespaceQuakeMLFiles, writeChangedQuakeML)
+
+ATTRIBUTES = {'catalog': {'datasource': 'XX', 'dataid': '999999',
+                          'eventsource': 'XX'}}
+
+
+def rid(kind, n):
+    return ResourceIdentifier('smi:local/{0}/{1}'.format(kind, n))
+
+
+def make_event(n):
+    """An event with an origin, magnitude, pick and focal mechanism"""
+    t = UTCDateTime(2012, 1, 1) + n * 3600.25
+    origin = Origin(resource_id=rid('origin', n), time=t,
+                    latitude=44. + n / 100., longitude=-123. - n / 100.,
+                    depth=10000. + n)
+    magnitude = Magnitude(resource_id=rid('magnitude', n), mag=1. + n / 10.,
+                          magnitude_type='ML', origin_id=origin.resource_id)
+    pick = Pick(resource_id=rid('pick', n), time=t + 5.5, phase_hint='P',
+                waveform_id=WaveformStreamID(network_code='XA',
+                                             station_code='TOL0',
+                                             channel_code='BHZ'))
+    planes = NodalPlanes(
+        nodal_plane_1=NodalPlane(strike=10. + n, dip=45., rake=90.),
+        nodal_plane_2=NodalPlane(strike=190. + n, dip=45., rake=90.))
+    focal_mechanism = FocalMechanism(resource_id=rid('focalmechanism', n),
+                                     nodal_planes=planes)
+    return Event(resource_id=rid('event', n), origins=[origin],
+                 magnitudes=[magnitude], picks=[pick],
+                 focal_mechanisms=[focal_mechanism],
+                 preferred_origin_id=origin.resource_id,
+                 preferred_magnitude_id=magnitude.resource_id)
+
+
+def make_catalog(count=40):
+    return Catalog(events=[make_event(n) for n in range(count)],
+                   resource_id=ResourceIdentifier('smi:local/catalog/1'))
+
+
+class WriterTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.catalog = make_catalog()
+        self.serial = NamespacePickler().dumps(self.catalog,
+                                               attributes=ATTRIBUTES)
+
+    def test_parallel_is_same_as_serial(self):
+        for workers in (2, 3):
+            xml = NamespacePickler().dumps(self.catalog, workers=workers,
+                                           attributes=ATTRIBUTES)
+            self.assertEqual(xml, self.serial)
+
+    def test_streamed_is_same_as_serial(self):
+        for workers in (None, 2):
+            fh = io.BytesIO()
+            count = streamNamespaceQuakeML(iter(self.catalog), fh,
+                catalog=self.catalog, workers=workers, attributes=ATTRIBUTES)
+            self.assertEqual(count, len(self.catalog))
+            self.assertEqual(fh.getvalue(), self.serial)
+        fh = io.BytesIO()
+        writeNamespaceQuakeML(self.catalog, fh, attributes=ATTRIBUTES)
+        self.assertEqual(fh.getvalue(), self.serial)
+
+    def test_cached_is_same_as_serial(self):
+        cache = FragmentCache()
+        for n in range(2):
+            xml = NamespacePickler().dumps(self.catalog, cache=cache,
+                                           attributes=ATTRIBUTES)
+            self.assertEqual(xml, self.serial)
+        self.assertEqual(cache.misses, len(self.catalog))
+        self.assertEqual(cache.hits, len(self.catalog))
+
+    def test_not_pretty_printed(self):
+        serial = NamespacePickler().dumps(self.catalog, pretty_print=False,
+                                          attributes=ATTRIBUTES)
+        xml = NamespacePickler().dumps(self.catalog, pretty_print=False,
+                                       workers=2, attributes=ATTRIBUTES)
+        self.assertEqual(xml, serial)
+
+    def test_no_events(self):
+        catalog = Catalog(resource_id=ResourceIdentifier('smi:local/catalog/2'))
+        fh = io.BytesIO()
+        self.assertEqual(streamNamespaceQuakeML([], fh, catalog), 0)
+        self.assertEqual(fh.getvalue(), NamespacePickler().dumps(catalog))
+
+
+class FragmentCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.catalog = make_catalog(10)
+
+    def _ids(self, events):
+        return [str(event.resource_id) for event in events]
+
+    def test_changed(self):
+        cache = FragmentCache()
+        cache.serialize(self.catalog)
+        self.assertEqual(self._ids(cache.changed), self._ids(self.catalog))
+        cache.serialize(self.catalog)
+        self.assertEqual(cache.changed, [])
+        self.catalog[3].origins[0].depth += 1000.
+        self.catalog.append(make_event(10))
+        cache.serialize(self.catalog)
+        self.assertEqual(self._ids(cache.changed),
+                         self._ids([self.catalog[3], self.catalog[10]]))
+        # Other options are other fragments
+        cache.serialize(self.catalog, attributes=ATTRIBUTES)
+        self.assertEqual(len(cache.changed), len(self.catalog))
+
+    def test_removed_events_are_forgotten(self):
+        cache = FragmentCache()
+        cache.serialize(self.catalog)
+        self.assertEqual(len(cache), 10)
+        cache.serialize(self.catalog[:4])
+        self.assertEqual(len(cache), 4)
+        # Back again, so changed (new) again
+        cache.serialize(self.catalog)
+        self.assertEqual(self._ids(cache.changed), self._ids(self.catalog[4:]))
+
+    def test_same_public_id(self):
+        cache = FragmentCache()
+        other = make_event(1)
+        other.origins[0].depth = 0.
+        self.assertRaises(ValueError, cache.serialize,
+                          [self.catalog[0], self.catalog[1], other])
+
+    def test_save_and_load(self):
+        cache = FragmentCache()
+        fragments = cache.serialize(self.catalog)
+        directory = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(directory, 'anss.cache')
+            self.assertEqual(len(FragmentCache.load(fname)), 0)
+            cache.save(fname)
+            loaded = FragmentCache.load(fname)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(loaded.serialize(self.catalog), fragments)
+        self.assertEqual(loaded.changed, [])
+        self.assertEqual(loaded.misses, 0)
+
+
+class ReaderTestCase(unittest.TestCase):
+
+    def test_round_trip(self):
+        catalog = make_catalog(5)
+        fh = io.BytesIO()
+        writeNamespaceQuakeML(catalog, fh, attributes=ATTRIBUTES)
+        fh.seek(0)
+        events = list(iterNamespaceQuakeML(fh))
+        self.assertEqual(len(events), len(catalog))
+        for event, original in zip(events, catalog):
+            self.assertEqual(event.resource_id, original.resource_id)
+            self.assertEqual(event.origins[0].time, original.origins[0].time)
+            self.assertEqual(event.origins[0].depth, original.origins[0].depth)
+            self.assertEqual(event.magnitudes[0].mag, original.magnitudes[0].mag)
+            self.assertEqual(event.picks[0].waveform_id.station_code, 'TOL0')
+            self.assertEqual(event.namespace_attributes, ATTRIBUTES)
+            self.assertEqual(event.focal_mechanisms[0].namespace_attributes,
+                             ATTRIBUTES)
+        # Written back out, it's the same document
+        fh.seek(0)
+        again = NamespacePickler().dumps(Catalog(events=events,
+            resource_id=catalog.resource_id), attributes=ATTRIBUTES)
+        self.assertEqual(again, fh.getvalue())
+
+
+class EventFilesTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.template = os.path.join(self.dir, '{name}.xml')
+        self.catalog = make_catalog(6)
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def _check_report(self, report, events):
+        self.assertEqual([r[0] for r in report],
+                         [str(event.resource_id) for event in events])
+        for (public_id, fname, error), event in zip(report, events):
+            self.assertEqual(error, None)
+            self.assertEqual(fname, self.template.format(
+                name=public_id.rsplit('/', 1)[-1]))
+            read = list(iterNamespaceQuakeML(fname))
+            self.assertEqual(len(read), 1)
+            self.assertEqual(read[0].resource_id, event.resource_id)
+            self.assertEqual(read[0].namespace_attributes, ATTRIBUTES)
+
+    def test_report(self):
+        for workers in (None, 3):
+            report = writeNamespaceQuakeMLFiles(self.catalog, self.template,
+                workers=workers, attributes=ATTRIBUTES)
+            self._check_report(report, self.catalog)
+        # Nothing but the event files is left behind
+        self.assertEqual(sorted(os.listdir(self.dir)),
+                         sorted(['{0}.xml'.format(n) for n in range(6)]))
+
+    def test_failures_are_reported(self):
+        template = os.path.join(self.dir, 'missing', '{name}.xml')
+        report = writeNamespaceQuakeMLFiles(self.catalog, template)
+        self.assertEqual(len(report), len(self.catalog))
+        for public_id, fname, error in report:
+            self.assertNotEqual(error, None)
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def test_mode(self):
+        umask = os.umask(0o022)
+        try:
+            report = writeNamespaceQuakeMLFiles(self.catalog, self.template)
+        finally:
+            os.umask(umask)
+        for public_id, fname, error in report:
+            self.assertEqual(stat.S_IMODE(os.stat(fname).st_mode), 0o644)
+
+    def test_changed_files(self):
+        cache = FragmentCache()
+        cache.serialize(self.catalog, attributes=ATTRIBUTES)
+        self.catalog[2].origins[0].latitude = 45.5
+        cache.serialize(self.catalog, attributes=ATTRIBUTES)
+        report = writeChangedQuakeML(cache, self.template, attributes=ATTRIBUTES)
+        self._check_report(report, [self.catalog[2]])
+        self.assertEqual(os.listdir(self.dir), ['2.xml'])
+
+
+if __name__ == '__main__':
+    unittest.main()
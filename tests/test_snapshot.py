@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+#
+# Tests of saving and loading snapshots, which only needs numpy (taking
+# them from a database needs Antelope)
+#
+# Use: python -m unittest discover tests
+#      (obspy_ext must be importable, e.g. on PYTHONPATH)
+#
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+import numpy
+from obspy_ext.antelope.snapshot import META, Snapshot
+
+
+class SnapshotTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.directory = os.path.join(self.dir, 'db.snapshots', 'origin')
+        self.data = numpy.array([(1, 44.5, 'TOL0'), (2, -12.25, 'TOL1')],
+                                dtype=[('orid', 'i8'), ('lat', 'f8'),
+                                       ('auth', 'U15')])
+        self.stamps = {os.path.join(self.dir, 'db.origin'): None}
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_save_and_load(self):
+        snap = Snapshot.save(self.directory, 'origin', self.data, self.stamps)
+        self.assertEqual(len(snap), 2)
+        self.assertEqual(snap.fields, ('orid', 'lat', 'auth'))
+        numpy.testing.assert_array_equal(snap.to_structured(), self.data)
+        self.assertEqual(list(snap.rows()), self.data.tolist())
+        self.assertTrue(snap.is_current())
+        self.assertEqual(snap.definition, None)
+        definition = 'DbQuery(origin | subset auth == "ANF")'
+        snap = Snapshot.save(self.directory, 'origin', self.data, self.stamps,
+                             definition)
+        self.assertEqual(Snapshot(self.directory).definition, definition)
+
+    def test_saving_again_keeps_loaded_columns(self):
+        snap = Snapshot.save(self.directory, 'origin', self.data, self.stamps)
+        data = self.data.copy()
+        data['lat'] = 0.
+        for n in range(3):
+            new = Snapshot.save(self.directory, 'origin', data, self.stamps)
+        numpy.testing.assert_array_equal(snap['lat'], self.data['lat'])
+        numpy.testing.assert_array_equal(new['lat'], data['lat'])
+        numpy.testing.assert_array_equal(Snapshot(self.directory)['lat'],
+                                         data['lat'])
+
+    def test_readable_by_other_users(self):
+        umask = os.umask(0o022)
+        try:
+            snap = Snapshot.save(self.directory, 'origin', self.data,
+                                 self.stamps)
+        finally:
+            os.umask(umask)
+        mode = stat.S_IMODE(os.stat(os.path.join(self.directory, META)).st_mode)
+        self.assertEqual(mode, 0o644)
+        mode = stat.S_IMODE(os.stat(snap.columns_dir).st_mode)
+        self.assertEqual(mode, 0o755)
+        for field in snap.fields:
+            fname = os.path.join(snap.columns_dir, field + '.npy')
+            self.assertEqual(stat.S_IMODE(os.stat(fname).st_mode), 0o644)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+#
+# Tests of the wfdisc helpers which only need numpy (no Antelope or ObsPy)
+#
+# Use: python -m unittest discover tests
+#      (obspy_ext must be importable, e.g. on PYTHONPATH)
+#
+import os
+import random
+import re
+import shutil
+import tempfile
+import unittest
+import numpy
+from obspy_ext.antelope.wfdisc import (read_raw, sample_range, chunk_range,
+                                       WfdiscIndex, WaveformCache)
+
+
+class SampleRangeTestCase(unittest.TestCase):
+
+    def test_window_edges_are_inclusive(self):
+        # 1 Hz samples at .64 s
+        time = 1213315199.64
+        self.assertEqual(sample_range(time, 1., 86401), (0, 86401))
+        self.assertEqual(sample_range(time, 1., 86401, time + 10, time + 20),
+                         (10, 21))
+        self.assertEqual(sample_range(time, 1., 86401, time + 9.5, time + 20.5),
+                         (10, 21))
+        # Clipped to the segment, and empty outside of it
+        self.assertEqual(sample_range(time, 1., 100, time - 50, time + 500),
+                         (0, 100))
+        self.assertEqual(sample_range(time, 1., 100, time + 200, time + 300),
+                         (200, 200))
+        self.assertEqual(sample_range(time, 1., 100, time - 20, time - 10),
+                         (0, 0))
+
+    def test_float_time_on_a_sample(self):
+        time = 1213315199.64
+        samprate = 40.
+        for n in (1, 3, 1000, 86399, 3456789):
+            t = time + n / samprate
+            self.assertEqual(sample_range(time, samprate, 10**7, t, t), (n, n + 1))
+
+    def _check_chunks(self, time, samprate, nsamp, start, chunk):
+        got = []
+        c0 = start
+        while c0 < time + nsamp / samprate:
+            first, last = chunk_range(time, samprate, nsamp, c0, c0 + chunk)
+            got.extend(range(first, last))
+            c0 += chunk
+        first = sample_range(time, samprate, nsamp, starttime=start)[0]
+        self.assertEqual(got, list(range(first, nsamp)))
+
+    def test_chunks_cover_every_sample_once(self):
+        # A day of the TOL0 rows (at .64 s) in hours from midnight
+        self._check_chunks(1213315199.64, 1., 86401, 1213315200., 3600.)
+        # Chunk grid on the sample grid
+        self._check_chunks(1213315200., 1., 86400, 1213315200., 3600.)
+        rng = random.Random(4)
+        for n in range(200):
+            samprate = rng.choice([1., 20., 40., 100., 0.1, 3.])
+            time = 1213315200. + rng.uniform(-10, 10)
+            nsamp = rng.randrange(1, 5000)
+            start = time - rng.uniform(0, 5)
+            chunk = rng.choice([1., 7.3, 60., 3600.])
+            self._check_chunks(time, samprate, nsamp, start, chunk)
+
+
+class WfdiscIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        rng = numpy.random.RandomState(6)
+        n = 3000
+        self.sta = rng.choice(['TOL0', 'TOL1', 'HIA'], n)
+        self.chan = rng.choice(['BHZ', 'BHN', 'LHZ'], n)
+        self.time = rng.uniform(0, 86400 * 10, n)
+        # Mostly short segments, a few very long ones
+        length = rng.exponential(3600, n)
+        length[rng.rand(n) < .02] *= 100
+        self.endtime = self.time + length
+        self.index = WfdiscIndex(self.sta, self.chan, self.time, self.endtime)
+
+    def _scan(self, station=None, channel=None, starttime=None, endtime=None):
+        keep = numpy.ones(len(self.time), dtype=bool)
+        if station is not None:
+            keep &= numpy.array([bool(re.match('(?:{0})$'.format(station), s))
+                                 for s in self.sta])
+        if channel is not None:
+            keep &= numpy.array([bool(re.match('(?:{0})$'.format(channel), c))
+                                 for c in self.chan])
+        if starttime is not None:
+            keep &= self.endtime > starttime
+        if endtime is not None:
+            keep &= self.time < endtime
+        return numpy.flatnonzero(keep)
+
+    def test_query_matches_a_scan(self):
+        rng = random.Random(6)
+        for n in range(300):
+            station = rng.choice([None, 'TOL0', 'TOL.', 'HIA|TOL1', 'XYZ'])
+            channel = rng.choice([None, 'BHZ', 'BH.', '.HZ'])
+            t0 = rng.uniform(-3600, 86400 * 11)
+            t1 = t0 + rng.choice([1., 60., 3600., 86400.])
+            t0 = rng.choice([t0, None])
+            t1 = rng.choice([t1, None])
+            numpy.testing.assert_array_equal(
+                self.index.query(station, channel, t0, t1),
+                self._scan(station, channel, t0, t1))
+
+    def test_record_numbers(self):
+        record = numpy.arange(len(self.time)) + 1000
+        index = WfdiscIndex(self.sta, self.chan, self.time, self.endtime,
+                            record=record)
+        numpy.testing.assert_array_equal(index.query('TOL0', 'BHZ', 1e5, 2e5),
+                                         self._scan('TOL0', 'BHZ', 1e5, 2e5) + 1000)
+
+    def test_save_and_load(self):
+        directory = tempfile.mkdtemp()
+        try:
+            fname = os.path.join(directory, 'db.wfdisc.idx.npz')
+            index = WfdiscIndex(self.sta, self.chan, self.time, self.endtime,
+                                stamp=(1213315200.5, 1234.))
+            index.save(fname)
+            loaded = WfdiscIndex.load(fname)
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(loaded.stamp, (1213315200.5, 1234.))
+        self.assertEqual(loaded.channels, index.channels)
+        numpy.testing.assert_array_equal(loaded.query('HIA', None, 5e5, 6e5),
+                                         index.query('HIA', None, 5e5, 6e5))
+
+    def test_empty(self):
+        index = WfdiscIndex([], [], [], [])
+        self.assertEqual(len(index), 0)
+        self.assertEqual(len(index.query('TOL0', 'BHZ', 0, 1)), 0)
+
+
+class WaveformCacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.dir, 'wf.s4')
+        self.foff = 400
+        self.nsamp = 100000
+        self.samples = numpy.arange(self.nsamp, dtype='i4') * 3 - 7
+        with open(self.fname, 'wb') as fh:
+            fh.write(b'\0' * self.foff)
+            fh.write(self.samples.astype('>i4').tobytes())
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_random_overlapping_reads(self):
+        rng = random.Random(12)
+        for block_size, maxbytes in [(1000, 10**9), (1000, 40000), (4096, 10**6)]:
+            cache = WaveformCache(maxbytes=maxbytes, block_size=block_size)
+            for n in range(300):
+                first = rng.randrange(0, self.nsamp - 1)
+                last = rng.randrange(first + 1, min(self.nsamp, first + 5000) + 1)
+                data = cache.read(self.fname, 's4', self.foff, first, last)
+                numpy.testing.assert_array_equal(data, self.samples[first:last])
+                self.assertTrue(cache.nbytes <= maxbytes)
+            self.assertEqual(cache.hits + cache.misses, 300)
+
+    def test_gap_before_cached_piece(self):
+        cache = WaveformCache(block_size=100)
+        cache.read(self.fname, 's4', self.foff, 75724, 76453)
+        data = cache.read(self.fname, 's4', self.foff, 75641, 76024)
+        numpy.testing.assert_array_equal(data, self.samples[75641:76024])
+
+    def test_sliding_window_stays_in_budget(self):
+        cache = WaveformCache(maxbytes=40000, block_size=1000)
+        for first in range(0, 50000, 500):
+            data = cache.read(self.fname, 's4', self.foff, first, first + 2000)
+            numpy.testing.assert_array_equal(data, self.samples[first:first + 2000])
+        self.assertTrue(len(cache) > 0)
+        self.assertTrue(cache.nbytes <= 40000)
+        self.assertTrue(cache.evictions > 0)
+        # The newest window is all cached
+        misses = cache.misses
+        cache.read(self.fname, 's4', self.foff, first, first + 2000)
+        self.assertEqual(cache.misses, misses)
+
+    def test_read_is_a_copy(self):
+        cache = WaveformCache()
+        data = cache.read(self.fname, 's4', self.foff, 10, 20)
+        data[:] = 0
+        again = cache.read(self.fname, 's4', self.foff, 10, 20)
+        numpy.testing.assert_array_equal(again, self.samples[10:20])
+
+    def test_changed_file_is_reread(self):
+        cache = WaveformCache()
+        cache.read(self.fname, 's4', self.foff, 0, 10)
+        with open(self.fname, 'ab') as fh:
+            fh.write(b'\0' * 4)
+        data = cache.read(self.fname, 's4', self.foff, 0, 10)
+        numpy.testing.assert_array_equal(data, self.samples[:10])
+        self.assertEqual(cache.misses, 2)
+
+
+if __name__ == '__main__':
+    unittest.main()